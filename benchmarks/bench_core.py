@@ -0,0 +1,30 @@
+from harness import setup_path, make_image, measure, report, SEED
+
+def run(sizes, modes, formats, repeat):
+    setup_path()
+    from scripts.core import core, decoy
+
+    results = []
+
+    def add(case, fn, size, mode=None, nbytes=0):
+        result = dict(suite='core', case=case, size=size, mode=mode, **measure(fn, repeat, nbytes=nbytes))
+        report(result)
+        results.append(result)
+
+    for size in sizes:
+        for mode in modes:
+            image = make_image(size, mode)
+            nbytes = size * size * len(image.getbands())
+            add('encrypt_v2', lambda: core.process_image_bands(image, SEED, 2, digest='b2'), size, mode, nbytes)
+            add('decrypt_v2', lambda: core.process_image_bands(image, SEED, 2, digest='b2', encrypt=False), size, mode, nbytes)
+            add('encrypt_v1', lambda: core.process_image_bands(image, SEED, 1, digest='md5'), size, mode, nbytes)
+            add('rekey_v2', lambda: core.rekey_image_bands(image, SEED, SEED + 1, 2, 'b2'), size, mode, nbytes)
+            add('process_image', lambda: core.process_image(image, SEED), size, mode, nbytes)
+            add('get_image_hash', lambda: core.get_image_hash(image), size, mode, nbytes)
+
+        data = bytes(size * size * 3)
+        add('process_bytes', lambda: core.process_bytes(data, SEED, digest='b2'), size, None, len(data))
+        add('generate_fake_image', lambda: core.generate_fake_image(size, size), size)
+        add('get_decoy_image', lambda: decoy.get_decoy_image(size, size), size)
+
+    return results
@@ -0,0 +1,80 @@
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+from harness import load_plugin, set_opts, make_image, percentile, report
+
+FILES = 16
+CONCURRENCY = (1, 4, 16, 64)
+
+def run(sizes, modes, formats, repeat):
+    antiseek = load_plugin()
+    import httpx
+    from fastapi import FastAPI
+    from fastapi.responses import FileResponse
+    from modules import script_callbacks
+
+    app = FastAPI()
+
+    @app.get('/file={path:path}')
+    def serve_file(path: str):
+        return FileResponse(path)
+
+    script_callbacks.app_started_callback(None, app)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='antiseek-bench-http-')
+
+    async def fetch(client, url, latencies, statuses):
+        start = time.perf_counter()
+        response = await client.get(url)
+        latencies.append(time.perf_counter() - start)
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    async def burst(urls, concurrency):
+        latencies, statuses = [], {}
+        semaphore = asyncio.Semaphore(concurrency)
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            async def limited(url):
+                async with semaphore:
+                    await fetch(client, url, latencies, statuses)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(limited(url) for url in urls))
+            elapsed = time.perf_counter() - start
+        return latencies, statuses, elapsed
+
+    for size in sizes:
+        for mode in modes:
+            image = make_image(size, mode)
+            for fmt in formats:
+                set_opts(samples_format=fmt, antiseek_mode='pixels', antiseek_async_save=False)
+                paths = [os.path.join(workdir, f"{size}-{mode}-{fmt}-{i}.png") for i in range(FILES)]
+                for path in paths:
+                    image.save(path)
+                urls = [f"/file={path}" for path in paths]
+
+                for concurrency in CONCURRENCY:
+                    for case in ('cold', 'warm'):
+                        if case == 'cold':
+                            antiseek.get_response_cache().clear()
+                            antiseek.get_decrypt_cache().clear()
+                        latencies, statuses, elapsed = asyncio.run(burst(urls * repeat if case == 'warm' else urls, concurrency))
+                        result = {
+                            'suite': 'middleware', 'case': case, 'size': size, 'mode': mode, 'format': fmt, 'concurrency': concurrency,
+                            'requests': len(latencies),
+                            'median_ms': statistics.median(latencies) * 1e3,
+                            'p95_ms': percentile(latencies, 95) * 1e3,
+                            'max_ms': max(latencies) * 1e3,
+                            'requests_per_s': len(latencies) / elapsed,
+                            'statuses': {str(code): count for code, count in sorted(statuses.items())},
+                        }
+                        report(result)
+                        results.append(result)
+
+                for path in paths:
+                    os.remove(path)
+
+    return results
@@ -0,0 +1,52 @@
+import os
+import tempfile
+from harness import load_plugin, set_opts, make_image, measure, report
+
+WRITERS = [(True, 0), (False, 0), (False, 6)]
+
+def run(sizes, modes, formats, repeat):
+    antiseek = load_plugin()
+    from PIL import Image
+    from modules.api import api
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='antiseek-bench-files-')
+
+    def add(case, fn, size, mode, fmt, enc_mode, **extra):
+        result = dict(suite='plugin', case=case, size=size, mode=mode, format=fmt, enc_mode=enc_mode, **measure(fn, repeat), **extra)
+        report(result)
+        results.append(result)
+
+    for size in sizes:
+        for mode in modes:
+            image = make_image(size, mode)
+            for fmt in formats:
+                for enc_mode in ('pixels', 'bytes'):
+                    path = os.path.join(workdir, f"{size}-{mode}-{fmt}-{enc_mode}.png")
+                    set_opts(samples_format=fmt, antiseek_mode=enc_mode, antiseek_async_save=False, antiseek_decrypt_cache_mb=0)
+                    if enc_mode == 'pixels' and fmt == 'png':
+                        # The ciphertext PNG writers: the fast writer against
+                        # Pillow's, stored and at Pillow's default level.
+                        for fast_png, compress_level in WRITERS:
+                            set_opts(antiseek_fast_png=fast_png, antiseek_compress_level=compress_level)
+                            writer = f"{'fast' if fast_png else 'pillow'}-{compress_level}"
+                            add('save_writer', lambda: image.save(path), size, mode, fmt, enc_mode, writer=writer)
+                        set_opts(antiseek_fast_png=True, antiseek_compress_level=0)
+                    add('save', lambda: image.save(path), size, mode, fmt, enc_mode)
+                    file_bytes = os.path.getsize(path)
+
+                    def open_load():
+                        opened = Image.open(path)
+                        opened.load()
+                        return opened
+
+                    add('open_cold', open_load, size, mode, fmt, enc_mode, file_bytes=file_bytes)
+                    set_opts(antiseek_decrypt_cache_mb=4096)
+                    add('open_cached', open_load, size, mode, fmt, enc_mode, file_bytes=file_bytes)
+
+                    opened = open_load()
+                    add('encode_pil_to_base64', lambda: api.encode_pil_to_base64(opened), size, mode, fmt, enc_mode)
+                    antiseek.get_decrypt_cache().clear()
+                    os.remove(path)
+
+    return results
@@ -0,0 +1,42 @@
+import argparse
+import json
+import sys
+
+KEY_FIELDS = ('suite', 'case', 'size', 'mode', 'format', 'enc_mode', 'writer', 'concurrency')
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return data.get('meta', {}), {tuple(result.get(key) for key in KEY_FIELDS): result for result in data['results']}
+
+def main():
+    parser = argparse.ArgumentParser(description="对比两次基准测试结果")
+    parser.add_argument('baseline', help="基准结果 JSON")
+    parser.add_argument('current', help="当前结果 JSON")
+    parser.add_argument('--threshold', type=float, default=0.10, help="中位耗时增加超过该比例即视为退化 (默认: 0.10)")
+    args = parser.parse_args()
+
+    base_meta, baseline = load_results(args.baseline)
+    cur_meta, current = load_results(args.current)
+    print(f"{base_meta.get('revision')} -> {cur_meta.get('revision')}")
+
+    regressions = 0
+    for key in sorted(set(baseline) & set(current), key=str):
+        before, after = baseline[key]['median_ms'], current[key]['median_ms']
+        ratio = after / before if before else float('inf')
+        flag = ''
+        if ratio > 1 + args.threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = '  faster'
+        label = ' '.join(str(value) for value in key if value is not None)
+        print(f"{label}: {before:.2f} -> {after:.2f} ms ({ratio:.2f}x){flag}")
+
+    missing = len(set(baseline) ^ set(current))
+    if missing:
+        print(f"{missing} cases only present in one of the files")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import importlib
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_DIR = os.path.join(BENCH_DIR, 'stubs')
+SEED = 1234567
+
+def setup_path():
+    for path in (REPO_DIR, STUB_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    try:
+        import gradio
+    except ImportError:
+        sys.path.append(os.path.join(STUB_DIR, 'fallback'))
+
+def load_plugin():
+    setup_path()
+    antiseek = importlib.import_module('scripts.antiseek')
+    from modules import script_callbacks
+    if not getattr(antiseek, '_bench_settings_loaded', False):
+        script_callbacks.ui_settings_callback()
+        antiseek._bench_settings_loaded = True
+    return antiseek
+
+def set_opts(**values):
+    from modules import shared
+    for key, value in values.items():
+        setattr(shared.opts, key, value)
+
+def make_image(size, mode):
+    # Smooth colour fields with a little grain: compresses like a real render
+    # rather than like noise, which matters for the format encoders.
+    from PIL import Image
+    rng = np.random.default_rng(size)
+    base = Image.fromarray(rng.integers(0, 256, (16, 16, 3), dtype=np.uint8), 'RGB')
+    base = base.resize((size, size), Image.BICUBIC)
+    grain = rng.integers(-8, 9, (size, size, 3), dtype=np.int16)
+    image = Image.fromarray(np.clip(np.asarray(base, dtype=np.int16) + grain, 0, 255).astype(np.uint8), 'RGB')
+    if mode == 'P':
+        return image.quantize(256)
+    return image.convert(mode)
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(pct / 100 * (len(values) - 1))))]
+
+def measure(fn, repeat=5, warmup=1, nbytes=0):
+    # Timings run without tracemalloc; one extra traced call records the peak
+    # of Python and NumPy allocations (Pillow's own buffers are not traced).
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    median = statistics.median(times)
+    return {
+        'repeat': repeat,
+        'min_ms': min(times) * 1e3,
+        'median_ms': median * 1e3,
+        'mean_ms': statistics.mean(times) * 1e3,
+        'p95_ms': percentile(times, 95) * 1e3,
+        'ops_per_s': 1 / median if median else None,
+        'mb_per_s': nbytes / median / (1 << 20) if nbytes and median else None,
+        'peak_mb': peak / (1 << 20),
+    }
+
+def report(result):
+    label = ' '.join(str(result[key]) for key in ('suite', 'case', 'size', 'mode', 'format', 'enc_mode', 'writer', 'concurrency') if result.get(key) is not None)
+    extra = f", {result['mb_per_s']:.0f} MB/s" if result.get('mb_per_s') else ''
+    extra += f", {result['peak_mb']:.1f} MB peak" if result.get('peak_mb') is not None else ''
+    print(f"{label}: {result['median_ms']:.2f} ms median, p95 {result['p95_ms']:.2f} ms{extra}", flush=True)
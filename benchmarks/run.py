@@ -0,0 +1,70 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import numpy as np
+import PIL
+from harness import BENCH_DIR, REPO_DIR
+import bench_core
+import bench_plugin
+import bench_middleware
+
+SUITES = {
+    'core': bench_core.run,
+    'plugin': bench_plugin.run,
+    'middleware': bench_middleware.run,
+}
+
+def get_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+def main():
+    parser = argparse.ArgumentParser(description="Anti-Seek 性能基准测试")
+    parser.add_argument('--suite', default='core,plugin,middleware', help="要运行的测试组, 逗号分隔 (core, plugin, middleware)")
+    parser.add_argument('--sizes', default='512,1024,2048,4096,8192', help="图片边长, 逗号分隔")
+    parser.add_argument('--modes', default='RGB,RGBA,L,P', help="图片模式, 逗号分隔")
+    parser.add_argument('--formats', default='png,jpg,webp', help="输出格式, 逗号分隔")
+    parser.add_argument('--repeat', type=int, default=5, help="每项重复次数")
+    parser.add_argument('--quick', action='store_true', help="快速模式: 仅 512,1024 与 RGB, png")
+    parser.add_argument('-o', '--output', default=None, help="结果 JSON 路径 (默认: benchmarks/results/<版本>-<时间>.json)")
+    args = parser.parse_args()
+
+    if args.quick:
+        args.sizes, args.modes, args.formats = '512,1024', 'RGB', 'png'
+    sizes = parse_list(args.sizes, int)
+    modes = parse_list(args.modes)
+    formats = parse_list(args.formats)
+    revision = get_revision()
+
+    results = []
+    for name in parse_list(args.suite):
+        results.extend(SUITES[name](sizes, modes, formats, args.repeat))
+
+    output = args.output or os.path.join(BENCH_DIR, 'results', f"{revision or 'unknown'}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'meta': {
+                'revision': revision,
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'pillow': PIL.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'args': vars(args),
+            },
+            'results': results,
+        }, f, indent=1)
+    print(f"\nSaved {len(results)} results to {output}")
+
+if __name__ == "__main__":
+    main()
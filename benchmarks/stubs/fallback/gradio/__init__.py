@@ -0,0 +1,8 @@
+# Only put on sys.path when gradio itself is not installed.
+class Blocks: pass
+class Textbox: pass
+class Slider: pass
+class Checkbox: pass
+class Radio: pass
+class Dropdown: pass
+class Number: pass
@@ -0,0 +1,2 @@
+# Minimal stand-in for the WebUI's `modules` package, just enough for
+# scripts/antiseek.py to import and run outside the WebUI.
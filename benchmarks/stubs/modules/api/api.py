@@ -0,0 +1,7 @@
+import base64
+import io
+
+def encode_pil_to_base64(image):
+    with io.BytesIO() as output_bytes:
+        image.save(output_bytes, format="PNG")
+        return base64.b64encode(output_bytes.getvalue())
@@ -0,0 +1,27 @@
+import os
+import piexif
+import piexif.helper
+from PIL import PngImagePlugin
+from modules import script_callbacks, shared
+
+def save_image(image, filename, geninfo=None):
+    # The part of the WebUI's images.save_image() the plugin hooks into: the
+    # callbacks around a save to <name>.tmp that is then renamed into place.
+    params = script_callbacks.ImageSaveParams(image, None, filename, {'parameters': geninfo} if geninfo else {})
+    script_callbacks.before_image_saved_callback(params)
+    stem, extension = os.path.splitext(params.filename)
+    temp_file_path = f"{stem}.tmp"
+    if extension.lower() == '.png':
+        pnginfo = PngImagePlugin.PngInfo()
+        for key, value in params.pnginfo.items():
+            pnginfo.add_text(key, value)
+        image.save(temp_file_path, format='PNG', pnginfo=pnginfo)
+    else:
+        image_format = 'WEBP' if extension.lower() == '.webp' else 'JPEG'
+        image.save(temp_file_path, format=image_format, quality=shared.opts.jpeg_quality)
+        if geninfo:
+            user_comment = piexif.helper.UserComment.dump(geninfo, encoding='unicode')
+            piexif.insert(piexif.dump({'Exif': {piexif.ExifIFD.UserComment: user_comment}}), temp_file_path)
+    os.replace(temp_file_path, params.filename)
+    script_callbacks.image_saved_callback(params)
+    return params.filename
@@ -0,0 +1,47 @@
+callbacks_ui_settings = []
+callbacks_app_started = []
+callbacks_script_unloaded = []
+callbacks_before_image_saved = []
+callbacks_image_saved = []
+
+class ImageSaveParams:
+    def __init__(self, image, p, filename, pnginfo):
+        self.image = image
+        self.p = p
+        self.filename = filename
+        self.pnginfo = pnginfo
+
+def on_ui_settings(callback):
+    callbacks_ui_settings.append(callback)
+
+def on_app_started(callback):
+    callbacks_app_started.append(callback)
+
+def on_script_unloaded(callback):
+    callbacks_script_unloaded.append(callback)
+
+def on_before_image_saved(callback):
+    callbacks_before_image_saved.append(callback)
+
+def on_image_saved(callback):
+    callbacks_image_saved.append(callback)
+
+def ui_settings_callback():
+    for callback in callbacks_ui_settings:
+        callback()
+
+def app_started_callback(demo, app):
+    for callback in callbacks_app_started:
+        callback(demo, app)
+
+def script_unloaded_callback():
+    for callback in callbacks_script_unloaded:
+        callback()
+
+def before_image_saved_callback(params):
+    for callback in callbacks_before_image_saved:
+        callback(params)
+
+def image_saved_callback(params):
+    for callback in callbacks_image_saved:
+        callback(params)
@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+def basedir():
+    path = os.environ.get('ANTISEEK_BENCH_BASEDIR')
+    if not path:
+        path = os.environ['ANTISEEK_BENCH_BASEDIR'] = tempfile.mkdtemp(prefix='antiseek-bench-')
+    return path
@@ -0,0 +1,26 @@
+class OptionInfo:
+    def __init__(self, default=None, label="", component=None, component_args=None, onchange=None, section=None, **kwargs):
+        self.default = default
+        self.label = label
+        self.section = section
+
+    def info(self, info):
+        return self
+
+    def needs_reload_ui(self):
+        return self
+
+class Options:
+    def __init__(self):
+        self.data_labels = {}
+
+    def add_option(self, key, info):
+        self.data_labels[key] = info
+        if not hasattr(self, key):
+            setattr(self, key, info.default)
+
+opts = Options()
+opts.samples_format = 'png'
+opts.grid_format = 'png'
+opts.jpeg_quality = 80
+opts.webp_lossless = False
@@ -1,4 +1,4 @@
-onUiUpdate(function () {
+function antiseekRender() {
   let infoBox = document.getElementById("antiseek_info_box");
   var topElement = document.getElementById("txt2img_neg_prompt");
   if (!topElement) return;
@@ -16,21 +16,6 @@ onUiUpdate(function () {
     parent.appendChild(infoBox);
   }
 
-  if (typeof window.antiseek_last_fetch === "undefined") {
-    window.antiseek_last_fetch = 0;
-    window.antiseek_cached_count = 0;
-  }
-
-  if (Date.now() - window.antiseek_last_fetch > 2000) {
-    window.antiseek_last_fetch = Date.now();
-    fetch('/antiseek/count')
-      .then(res => res.json())
-      .then(data => {
-        window.antiseek_cached_count = data.count;
-      })
-      .catch(() => {});
-  }
-
   var salt = "禁用";
   var keyname = "s_tag";
 
@@ -40,8 +25,61 @@ onUiUpdate(function () {
   }
 
   var finalHTML = `<span><a href="https://github.com/Echoflare/sd-webui-antiseek" target="_blank" style="text-decoration: underline; pointer-events: auto;">Anti-Seek</a>: 安全加盐: ${salt} | 元数据键名: ${keyname} | 已加密: ${window.antiseek_cached_count}</span>`;
-  
+
   if (infoBox.innerHTML !== finalHTML) {
     infoBox.innerHTML = finalHTML;
   }
-});
\ No newline at end of file
+}
+
+function antiseekUpdate(data) {
+  window.antiseek_version = data.version;
+  if (window.antiseek_cached_count !== data.count) {
+    window.antiseek_cached_count = data.count;
+    antiseekRender();
+  }
+}
+
+// Fallback when EventSource is missing or the stream cannot be opened: a
+// long-poll that the server holds until the count changes.
+function antiseekPoll() {
+  var url = '/antiseek/count';
+  if (typeof window.antiseek_version !== "undefined") {
+    url += `?version=${window.antiseek_version}&wait=30`;
+  }
+  fetch(url)
+    .then(res => res.json())
+    .then(data => {
+      antiseekUpdate(data);
+      antiseekPoll();
+    })
+    .catch(() => setTimeout(antiseekPoll, 5000));
+}
+
+function antiseekSubscribe() {
+  if (typeof EventSource === "undefined") {
+    antiseekPoll();
+    return;
+  }
+
+  var source = new EventSource('/antiseek/events');
+  source.onmessage = event => {
+    try {
+      antiseekUpdate(JSON.parse(event.data));
+    } catch (e) {}
+  };
+  source.onerror = () => {
+    // EventSource retries transient errors by itself; CLOSED means the
+    // endpoint is unusable (e.g. a proxy rejected it).
+    if (source.readyState === EventSource.CLOSED) {
+      antiseekPoll();
+    }
+  };
+}
+
+onUiUpdate(function () {
+  if (typeof window.antiseek_cached_count === "undefined") {
+    window.antiseek_cached_count = 0;
+    antiseekSubscribe();
+  }
+  antiseekRender();
+});
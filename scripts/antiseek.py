@@ -1,28 +1,49 @@
 import base64
+import hashlib
+import hmac
 import io
+import json
 import random
 import os
+import asyncio
+import zipfile
 from pathlib import Path
 from modules import shared, script_callbacks, scripts as md_scripts, images
 from modules.api import api
 from modules.shared import opts
-from scripts.core.core import process_image, get_random_seed, mix_seed, get_image_hash, generate_fake_image
+from scripts.core.pool import BoundedPool, PoolFullError
+from scripts.core.png import TEXT_CHUNKS, get_payload_format, is_encrypted_file, can_write_png, write_png, read_png_chunk, decode_text_chunks, read_png_header, rewrite_png_text, PAYLOAD_CHUNK
+from scripts.core.stream import make_spool, parse_range, iter_body, ZipStream
+from scripts.core.writer import BackgroundWriter
+from scripts.core.diskcache import DiskCache
+from scripts.core.index import FileIndex, get_key_id, IMAGE_EXTS
+from scripts.core.preview import make_preview, parse_preview, read_preview, rekey_preview, fit_size, PREVIEW_CHUNK, PREVIEW_KEY, PREVIEW_QUALITY, MEDIA_TYPES
+from scripts.core.metrics import metrics
+from scripts.core import state
+from scripts.core.decoy import get_decoy_image, DECOY_POOL_SIZE
+from scripts.core.core import process_image_bands, process_bytes, get_random_seed, mix_seed, get_tag_algo, get_key_check, get_salt_candidates, parse_keyring, KEYSTREAM_VERSION, TAG_ALGO, KEY_CHECK_KEY, BAND_MODES
 from PIL import PngImagePlugin, _util, ImagePalette
 from PIL import Image as PILImage
 from io import BytesIO
-from typing import Optional
+from typing import Optional, List
+from pydantic import BaseModel
 from fastapi import FastAPI, Request, Response
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from gradio import Blocks
 import gradio as gr
 import sys
+import signal
+import threading
+import atexit
 from urllib.parse import unquote
+from email.utils import formatdate
 import piexif
 import piexif.helper
 
 repo_dir = md_scripts.basedir()
-
-if not hasattr(shared, 'antiseek_count'):
-    shared.antiseek_count = 0
+thumbnail_dir = os.path.join(repo_dir, 'cache', 'thumbnails')
+index_path = os.path.join(repo_dir, 'cache', 'index.sqlite')
 
 def on_ui_settings():
     section = ('antiseek', 'Anti-Seek (图像潜影)')
@@ -36,6 +57,15 @@ def on_ui_settings():
         ).info("Optional string to salt the random seed. / 可选字符串，用于混淆种子。")
     )
 
+    shared.opts.add_option(
+        "antiseek_keyring",
+        shared.OptionInfo(
+            "", "Additional Salts (Keyring) / 备用盐值 (密钥环)",
+            gr.Textbox,
+            section=section
+        ).info("Comma-separated salts also accepted when opening images, e.g. the previous salt during a migration. New images always use the salt above. Images with a key check (as_kc) only decrypt with the matching salt. / 以逗号分隔，打开图片时也会尝试这些盐值，例如迁移期间的旧盐值；新图片始终使用上方的盐值。带密钥校验 (as_kc) 的图片只会用匹配的盐值解密。")
+    )
+
     shared.opts.add_option(
         "antiseek_keyname",
         shared.OptionInfo(
@@ -45,6 +75,143 @@ def on_ui_settings():
         ).info("The key name used to store the seed in metadata. Default: s_tag / 用于存储种子的元数据键名。默认：s_tag")
     )
 
+    shared.opts.add_option(
+        "antiseek_mode",
+        shared.OptionInfo(
+            "pixels", "Encryption Mode / 加密模式",
+            gr.Radio,
+            {"choices": ["pixels", "bytes"]},
+            section=section
+        ).info("pixels: XOR the pixels and store a PNG. bytes: encode in the output format first, then encrypt the file bytes, which keeps JPEG/WebP small. / pixels：对像素加密并保存为 PNG；bytes：先按输出格式编码再加密文件字节，可保留 JPEG/WebP 的体积优势。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_compress_level",
+        shared.OptionInfo(
+            0, "Ciphertext PNG Compression Level / 密文 PNG 压缩等级",
+            gr.Slider,
+            {"minimum": 0, "maximum": 9, "step": 1},
+            section=section
+        ).info("Encrypted pixels are noise and do not compress; 0 stores them and saves fastest. / 加密后的像素是噪声，无法压缩；0 为直接存储，保存最快。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_fast_png",
+        shared.OptionInfo(
+            True, "Fast Ciphertext PNG Writer / 快速密文 PNG 写入",
+            gr.Checkbox,
+            section=section
+        ).info("Write encrypted PNGs without per-row filter search. Disable to use Pillow's adaptive filtering. / 写入密文时跳过逐行滤波选择；关闭则使用 Pillow 的自适应滤波。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_async_save",
+        shared.OptionInfo(
+            False, "Background Encryption / 后台加密保存",
+            gr.Checkbox,
+            section=section
+        ).info("Return from saving right away and encrypt/write outputs in background threads. Files appear once fully written. / 保存时立即返回，由后台线程加密并写入，文件写完后才会出现。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_save_workers",
+        shared.OptionInfo(
+            2, "Background Save Workers / 后台保存线程数",
+            gr.Slider,
+            {"minimum": 1, "maximum": 16, "step": 1},
+            section=section
+        ).info("Threads that encrypt and write queued outputs. / 负责加密并写入排队图片的线程数。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_save_queue",
+        shared.OptionInfo(
+            8, "Background Save Queue / 后台保存队列上限",
+            gr.Slider,
+            {"minimum": 1, "maximum": 256, "step": 1},
+            section=section
+        ).info("Images waiting to be written; generation pauses when the queue is full. / 等待写入的图片数，队列满时生成会暂停等待。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_workers",
+        shared.OptionInfo(
+            4, "Decrypt Workers / 解密工作线程数",
+            gr.Slider,
+            {"minimum": 1, "maximum": 32, "step": 1},
+            section=section
+        ).info("Threads used to decrypt and encode images for /file= requests. / 用于处理图片请求解密与编码的线程数。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_queue_limit",
+        shared.OptionInfo(
+            64, "Decrypt Queue Limit / 解密队列上限",
+            gr.Slider,
+            {"minimum": 0, "maximum": 1024, "step": 1},
+            section=section
+        ).info("Requests waiting beyond this limit get 503 with Retry-After instead of stalling the server. / 超出上限的请求将返回 503 并提示稍后重试。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_cache_mb",
+        shared.OptionInfo(
+            256, "Response Cache Size (MB) / 响应缓存大小 (MB)",
+            gr.Slider,
+            {"minimum": 0, "maximum": 4096, "step": 16},
+            section=section
+        ).info("Memory budget for decrypted /file= responses, 0 disables the cache. / 解密后图片响应的内存缓存上限，0 为禁用。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_decrypt_cache_mb",
+        shared.OptionInfo(
+            256, "Decrypted Image Cache Size (MB) / 解密图像缓存大小 (MB)",
+            gr.Slider,
+            {"minimum": 0, "maximum": 8192, "step": 16},
+            section=section
+        ).info("Memory budget for verified decrypted images shared by file requests, the API and Image.open; files that failed verification are remembered as well. 0 disables it. / 已校验解密图像的内存缓存上限，供图片请求、API 与 Image.open 共用，并记录校验失败的文件；0 为禁用。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_index",
+        shared.OptionInfo(
+            True, "Index Encrypted Files / 建立加密文件索引",
+            gr.Checkbox,
+            section=section
+        ).info("Keep a SQLite index of file headers and verification results in cache/index.sqlite, so requests for plain or unverifiable files are answered from one lookup instead of a decode. / 在 cache/index.sqlite 中记录文件头信息与校验结果，未加密或无法校验的文件只需一次查询即可判断，无需解码。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_preview_size",
+        shared.OptionInfo(
+            0, "Embedded Preview Size / 内嵌预览图尺寸",
+            gr.Slider,
+            {"minimum": 0, "maximum": 1024, "step": 64},
+            section=section
+        ).info("Longest side of a separately encrypted preview stored in each saved image, 0 disables it. Thumbnail requests up to this size decrypt only the preview; match it to the thumbnail size, e.g. 512. / 保存时在图片中内嵌一张单独加密的预览图并指定最长边，0 为禁用。不超过该尺寸的缩略图请求只需解密预览图，建议与缩略图尺寸一致，如 512。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_thumb_size",
+        shared.OptionInfo(
+            512, "Extra Networks Thumbnail Size / 扩展网络缩略图尺寸",
+            gr.Slider,
+            {"minimum": 0, "maximum": 2048, "step": 64},
+            section=section
+        ).info("Longest side of decrypted extra-networks previews, 0 serves the original. IIB thumbnails use the size they request. / 扩展网络预览图解密后的最长边，0 为原图；IIB 缩略图使用其请求的尺寸。")
+    )
+
+    shared.opts.add_option(
+        "antiseek_thumb_cache_mb",
+        shared.OptionInfo(
+            512, "Thumbnail Disk Cache Size (MB) / 缩略图磁盘缓存大小 (MB)",
+            gr.Slider,
+            {"minimum": 0, "maximum": 8192, "step": 64},
+            section=section
+        ).info("Disk budget for encrypted thumbnails in cache/thumbnails; the least recently viewed are removed first. 0 disables the disk cache. / cache/thumbnails 中加密缩略图的磁盘空间上限，超出时先删除最久未浏览的缩略图；0 为禁用。")
+    )
+
 def get_exif_bytes(pnginfo):
     exif_dict = {"0th": {}, "Exif": {}, "GPS": {}, "1st": {}, "thumbnail": None}
     
@@ -77,13 +244,401 @@ def get_pil_format_from_ext(ext_str):
     except:
         return 'PNG'
 
+def get_media_type(pil_format):
+    return {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'AVIF': 'image/avif'}.get(pil_format) or PILImage.MIME.get(pil_format, 'image/png')
+
+def get_encode_args(image, pnginfo_dict):
+    target_ext = pnginfo_dict.get('as_fmt', 'png')
+    pil_format = get_pil_format_from_ext(target_ext)
+    target_quality = int(pnginfo_dict.get('as_q', 90))
+    target_lossless = pnginfo_dict.get('as_l', 'False') == 'True'
+    save_kwargs = {}
+
+    if pil_format == 'JPEG':
+        save_kwargs['quality'] = target_quality
+        if image.mode not in ('RGB', 'L', 'CMYK'):
+            image = image.convert('RGB')
+        save_kwargs['exif'] = get_exif_bytes(pnginfo_dict)
+
+    elif pil_format == 'WEBP':
+        save_kwargs['quality'] = target_quality
+        if target_lossless:
+            save_kwargs['lossless'] = True
+        save_kwargs['exif'] = get_exif_bytes(pnginfo_dict)
+
+    elif pil_format == 'AVIF':
+        save_kwargs['quality'] = target_quality
+        save_kwargs['exif'] = get_exif_bytes(pnginfo_dict)
+
+    elif pil_format == 'PNG':
+        info = PngImagePlugin.PngInfo()
+        for key in pnginfo_dict.keys():
+            if key not in [getattr(shared.opts, 'antiseek_keyname', 's_tag'), 'e_info', 'as_fmt', 'as_q', 'as_l', 'as_v', 'as_m', KEY_CHECK_KEY, PREVIEW_KEY] and pnginfo_dict[key]:
+                info.add_text(key, str(pnginfo_dict[key]))
+        save_kwargs['pnginfo'] = info
+    else:
+        pil_format = "PNG"
+
+    return image, pil_format, save_kwargs
+
+def get_clean_info(info):
+    # What callers see of an encrypted file, before and after the decrypt: the
+    # seed and tags stay with the file, so info copied into a new save cannot
+    # carry them over.
+    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+    return {key: value for key, value in info.items() if key not in (key_name, 'e_info', 'as_v', 'as_m', KEY_CHECK_KEY, PREVIEW_KEY)}
+
+def strip_antiseek_text(pnginfo):
+    # A copy of pnginfo without the key name, e_info or any as_* text; save()
+    # writes fresh values for those.
+    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+    info = PngImagePlugin.PngInfo()
+    for chunk in pnginfo.chunks:
+        if chunk[0] in TEXT_CHUNKS:
+            key = chunk[1].split(b'\0', 1)[0].decode('latin-1')
+            if key in (key_name, 'e_info') or key.startswith('as_'):
+                continue
+        info.chunks.append(chunk)
+    return info
+
+def parse_thumb_size(value):
+    try:
+        parts = value.lower().replace(',', 'x').split('x')
+        width, height = int(parts[0]), int(parts[-1])
+        if width > 0 and height > 0:
+            return (width, height)
+    except:
+        pass
+    return None
+
+def get_thumb_cache():
+    budget = int(getattr(shared.opts, 'antiseek_thumb_cache_mb', 512) or 0) << 20
+    with state.thumb_lock:
+        if state.thumb_cache is None:
+            state.thumb_cache = DiskCache(thumbnail_dir, budget)
+    state.thumb_cache.resize(budget)
+    return state.thumb_cache
+
+def get_thumbnail_path(file_path, thumb_size):
+    # One file per source and size. The source's mtime and size are stored
+    # inside (as_src), so a changed source replaces its own thumbnail instead
+    # of leaving the old one behind.
+    payload = f"{os.path.abspath(file_path)}|{thumb_size[0]}x{thumb_size[1]}"
+    name = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    return os.path.join(thumbnail_dir, name[:2], name + '.png')
+
+def write_thumbnail(image, thumb_path, stamp):
+    tmp_path = f"{thumb_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        info = PngImagePlugin.PngInfo()
+        for key in ('as_fmt', 'as_q', 'as_l'):
+            if key in image.info:
+                info.add_text(key, str(image.info[key]))
+        info.add_text('as_src', stamp)
+        image.save_encrypted(tmp_path, pnginfo=info, preview=False)
+        os.replace(tmp_path, thumb_path)
+        get_thumb_cache().add(thumb_path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def open_thumbnail(file_path, thumb_size):
+    st = os.stat(file_path)
+    stamp = f"{st.st_mtime_ns}:{st.st_size}"
+    thumb_path = get_thumbnail_path(file_path, thumb_size)
+    cache = get_thumb_cache()
+    if cache.hit(thumb_path):
+        image = PILImage.open(thumb_path)
+        image.load()
+        if getattr(image, '_is_decrypted', False) and image.info.get('as_src') == stamp:
+            return image
+        # The source changed, or the thumbnail was made under another salt.
+        cache.remove(thumb_path)
+
+    image = PILImage.open(file_path)
+    image.load()
+    if getattr(image, '_is_decrypted', False):
+        image.thumbnail(thumb_size)
+        image._antiseek_bytes = None
+        if cache.budget:
+            write_thumbnail(image, thumb_path, stamp)
+    elif getattr(image, '_is_fake', False):
+        image.thumbnail(thumb_size)
+    return image
+
+def render_preview(file_path, thumb_size):
+    # Thumbnails are answered from the embedded preview when it is at least
+    # as large as the requested thumbnail; the full image is never touched.
+    header = read_png_header(file_path)
+    text = header['text'] if header else {}
+    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+    parsed = parse_preview(text.get(PREVIEW_KEY))
+    if parsed is None or key_name not in text:
+        return None
+    target = fit_size((header['width'], header['height']), thumb_size)
+    if parsed[1][0] + 1 < target[0] or parsed[1][1] + 1 < target[1]:
+        return None
+    preview = None
+    try:
+        seed = int(text[key_name])
+        for salt in get_salt_candidates(seed, get_keyring(), text.get(KEY_CHECK_KEY)):
+            preview = read_preview(file_path, text, seed, salt)
+            if preview is not None:
+                break
+    except (ValueError, OSError):
+        return None
+    if preview is None:
+        return None
+
+    fmt, size, plain = preview
+    metrics.inc('decrypted', source='preview')
+    buffered = make_spool()
+    if size[0] <= thumb_size[0] and size[1] <= thumb_size[1]:
+        buffered.write(plain)
+        return buffered, MEDIA_TYPES[fmt]
+    image = PILImage.open(BytesIO(plain))
+    image.thumbnail(thumb_size)
+    with metrics.timer('stage_seconds', stage='encode'):
+        image.save(buffered, format=fmt.upper(), quality=PREVIEW_QUALITY)
+    return buffered, MEDIA_TYPES[fmt]
+
+def render_file_response(file_path, thumb_size=None):
+    if thumb_size:
+        result = render_preview(file_path, thumb_size)
+        if result is not None:
+            return result
+        image = open_thumbnail(file_path, thumb_size)
+    else:
+        image = PILImage.open(file_path)
+        image.load()
+
+    if getattr(image, '_is_fake', False):
+        # Decoys are served without the source's text chunks so that a few
+        # encoded variants per size and format can be shared by every file.
+        image, pil_format, save_kwargs = get_encode_args(image, {'as_fmt': image.info.get('as_fmt', 'png')})
+        key = (image.size, pil_format, random.randrange(DECOY_POOL_SIZE))
+        body = state.decoy_cache.get(key)
+        if body is None:
+            buffered = BytesIO()
+            with metrics.timer('stage_seconds', stage='encode'):
+                image.save(buffered, format=pil_format, **save_kwargs)
+            body = buffered.getvalue()
+            state.decoy_cache.put(key, body, len(body))
+        buffered = make_spool()
+        buffered.write(body)
+        return buffered, get_media_type(pil_format)
+
+    if getattr(image, '_is_decrypted', False):
+        buffered = make_spool()
+        payload = getattr(image, '_antiseek_bytes', None)
+        if payload is not None:
+            buffered.write(payload)
+            return buffered, get_media_type(get_payload_format(payload) or get_pil_format_from_ext(image.info.get('as_fmt', 'png')))
+
+        image, pil_format, save_kwargs = get_encode_args(image, image.info or {})
+        with metrics.timer('stage_seconds', stage='encode'):
+            image.save(buffered, format=pil_format, **save_kwargs)
+        return buffered, get_media_type(pil_format)
+
+    return None
+
+def get_decrypt_cache():
+    state.decrypt_cache.resize(int(getattr(shared.opts, 'antiseek_decrypt_cache_mb', 256) or 0) << 20)
+    return state.decrypt_cache
+
+def get_decrypt_key(file_path, pnginfo):
+    if not isinstance(file_path, (str, Path)) or not file_path:
+        return None
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return None
+    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+    return (os.path.abspath(file_path), st.st_mtime_ns, pnginfo.get('e_info'), tuple(get_keyring()), key_name)
+
+def get_file_index():
+    if not getattr(shared.opts, 'antiseek_index', True):
+        return None
+    with state.index_lock:
+        if state.file_index is None:
+            try:
+                state.file_index = FileIndex(index_path, exclude=(os.path.dirname(thumbnail_dir),))
+            except Exception as e:
+                print(f"[Anti-Seek] File index disabled: {e}")
+                state.file_index = False
+        return state.file_index or None
+
+def get_current_key_id():
+    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+    return get_key_id('\0'.join(get_keyring()), key_name)
+
+def lookup_file(file_path):
+    # One indexed lookup per request; the header is only read for files the
+    # index has not seen at their current mtime and size.
+    index = get_file_index()
+    if index is not None:
+        try:
+            return index.scan(file_path, get_current_key_id())
+        except:
+            pass
+    return {'state': 'unknown' if is_encrypted_file(file_path) else 'plain'}
+
+def get_index_state(file_path):
+    index = get_file_index()
+    if index is None or not isinstance(file_path, (str, Path)):
+        return None
+    try:
+        entry = index.lookup(file_path, get_current_key_id())
+        return entry and entry['state']
+    except:
+        return None
+
+def index_status(file_path, status):
+    index = get_file_index()
+    if index is None or not isinstance(file_path, (str, Path)):
+        return
+    try:
+        st = os.stat(file_path)
+        key_id = get_current_key_id()
+        if not index.set_status(file_path, st.st_mtime_ns, st.st_size, status, key_id):
+            index.scan(file_path, key_id, status)
+    except:
+        pass
+
+def get_preview_limit():
+    return int(getattr(shared.opts, 'antiseek_preview_size', 0) or 0)
+
+def get_keyring():
+    return parse_keyring(getattr(shared.opts, 'antiseek_salt', ''), getattr(shared.opts, 'antiseek_keyring', ''))
+
+def get_response_cache():
+    state.response_cache.resize(int(getattr(shared.opts, 'antiseek_cache_mb', 256) or 0) << 20)
+    return state.response_cache
+
+def get_response_key(file_path, variant=''):
+    st = os.stat(file_path)
+    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+    return (os.path.abspath(file_path), st.st_mtime_ns, st.st_size, tuple(get_keyring()), key_name, variant)
+
+def get_response_headers(key):
+    # The key carries the salt, so the ETag is keyed with a per-process secret;
+    # a plain hash of it could be brute-forced offline for the salt.
+    # Last-Modified is informational only: a salt change keeps the mtime but
+    # changes the output, so revalidation goes through the ETag.
+    return {
+        'ETag': '"' + hmac.new(state.etag_secret, repr(key).encode('utf-8'), hashlib.sha1).hexdigest() + '"',
+        'Last-Modified': formatdate(key[1] / 1e9, usegmt=True),
+        'Cache-Control': 'private, no-cache',
+    }
+
+def get_http_pool():
+    workers = int(getattr(shared.opts, 'antiseek_workers', 4) or 1)
+    queue_limit = int(getattr(shared.opts, 'antiseek_queue_limit', 64) or 0)
+    if state.http_pool is None or state.http_pool.config != (workers, queue_limit):
+        if state.http_pool is not None:
+            state.http_pool.shutdown()
+        state.http_pool = BoundedPool(workers, queue_limit)
+    return state.http_pool
+
+def get_save_writer():
+    if not getattr(shared.opts, 'antiseek_async_save', False):
+        return None
+    workers = int(getattr(shared.opts, 'antiseek_save_workers', 2) or 1)
+    queue_limit = int(getattr(shared.opts, 'antiseek_save_queue', 8) or 1)
+    with state.writer_lock:
+        if state.save_writer is None or state.save_writer.config != (workers, queue_limit):
+            if state.save_writer is not None:
+                state.save_writer.shutdown()
+            state.save_writer = BackgroundWriter(workers, queue_limit, on_written=lambda path: index_status(path, 'ok'), on_failed=lambda path: metrics.inc('save_failed'))
+        return state.save_writer
+
+def get_final_path(tmp_path):
+    # images.save_image() announces the final name in before_image_saved,
+    # writes <name>.tmp and renames it. Only with the 'Replace' action, or
+    # when nothing is there yet, does the rename go to that exact name.
+    final = getattr(state.image_save, 'filename', None)
+    if not final or os.path.splitext(os.path.abspath(final))[0] != os.path.abspath(tmp_path)[:-4]:
+        return None
+    if getattr(shared.opts, 'save_images_replace_action', 'Replace') != 'Replace' and os.path.exists(final):
+        return None
+    return final
+
+def on_before_image_saved(params):
+    state.image_save.filename = params.filename
+    state.image_save.written = None
+
+def on_image_saved(params):
+    # The WebUI has renamed its .tmp by now, so a held job may land, and a
+    # .tmp written here is at its final name, which is what gets indexed.
+    written = getattr(state.image_save, 'written', None)
+    state.image_save.filename = state.image_save.written = None
+    if written is not None and os.path.splitext(os.path.abspath(params.filename))[0] == os.path.abspath(written)[:-4]:
+        index_status(params.filename, 'ok')
+    writer = state.save_writer
+    if writer is not None:
+        writer.release(params.filename)
+
+def wait_for_save(path):
+    writer = state.save_writer
+    if writer is not None and path:
+        writer.wait(path)
+
+def flush_saves():
+    with state.writer_lock:
+        if state.save_writer is not None:
+            state.save_writer.shutdown()
+            state.save_writer = None
+
+metrics.describe('encrypted', "Images encrypted on save")
+metrics.describe('decrypted', "Verified decrypts, from disk or the decrypt cache")
+metrics.describe('batch_items', "Files exported through /antiseek/batch, by status")
+metrics.describe('verify_failed', "Files that failed verification (wrong salt, key name or tag), by where it was decided")
+metrics.describe('save_failed', "Background saves that failed; waiting on the file re-raises the error")
+metrics.describe('decoys', "Decoy images produced")
+metrics.describe('bytes_served', "Response bytes sent by the /file= middleware")
+metrics.describe('requests', "Intercepted /file= requests by outcome")
+metrics.describe('stage_seconds', "Time per stage of one image: decode, keystream, xor, hash, copy, encode, write")
+metrics.describe('render_seconds', "Time to decrypt and encode one /file= response on the worker pool")
+metrics.gauge('http_queue', lambda: state.http_pool.pending if state.http_pool is not None else 0)
+metrics.gauge('save_queue', lambda: len(state.save_writer.jobs) if state.save_writer is not None else 0)
+metrics.gauge('response_cache', lambda: state.response_cache.stats())
+metrics.gauge('decrypt_cache', lambda: state.decrypt_cache.stats())
+metrics.gauge('decoy_cache', lambda: state.decoy_cache.stats())
+metrics.gauge('thumb_cache', lambda: state.thumb_cache.stats())
+
+def stream_response(req: Request, body, media_type, headers):
+    length = len(body) if isinstance(body, bytes) else body.seek(0, 2)
+    headers = dict(headers, **{'Accept-Ranges': 'bytes'})
+    byte_range = None
+    if req.headers.get('if-range', headers['ETag']) == headers['ETag']:
+        byte_range = parse_range(req.headers.get('range'), length)
+
+    if byte_range and byte_range[0] >= length:
+        if not isinstance(body, bytes):
+            body.close()
+        headers['Content-Range'] = f"bytes */{length}"
+        return Response(status_code=416, headers=headers)
+
+    status_code = 200
+    start, end = 0, length - 1
+    if byte_range:
+        start, end = byte_range
+        status_code = 206
+        headers['Content-Range'] = f"bytes {start}-{end}/{length}"
+    headers['Content-Length'] = str(end - start + 1)
+    metrics.inc('bytes_served', end - start + 1)
+    return StreamingResponse(iter_body(body, start, end), status_code=status_code, media_type=media_type, headers=headers)
+
 def hook_http_request(app: FastAPI):
     @app.middleware("http")
     async def image_decrypt_middleware(req: Request, call_next):
         endpoint: str = req.scope.get('path', 'err')
         endpoint = '/' + endpoint.strip('/')
+        thumb_size = None
 
         if endpoint.startswith('/infinite_image_browsing/image-thumbnail') or endpoint.startswith('/infinite_image_browsing/file'):
+            is_thumbnail = endpoint.startswith('/infinite_image_browsing/image-thumbnail')
             query_string: str = req.scope.get('query_string', b'').decode('utf-8')
             query_string = unquote(query_string)
             if query_string and 'path=' in query_string:
@@ -92,6 +647,8 @@ def hook_http_request(app: FastAPI):
                 for sub in query:
                     if sub.startswith('path='):
                         path = sub[sub.index('=') + 1:]
+                    elif sub.startswith('size=') and is_thumbnail:
+                        thumb_size = parse_thumb_size(sub[sub.index('=') + 1:])
                 if path:
                     endpoint = '/file=' + path
         
@@ -106,6 +663,9 @@ def hook_http_request(app: FastAPI):
                         path = sub[sub.index('=') + 1:]
                 if path:
                     endpoint = '/file=' + path
+                    size = int(getattr(shared.opts, 'antiseek_thumb_size', 512) or 0)
+                    if size > 0:
+                        thumb_size = (size, size)
 
         if endpoint.startswith('/file='):
             file_path = endpoint[6:] or ''
@@ -114,74 +674,323 @@ def hook_http_request(app: FastAPI):
             
             ext = file_path[file_path.rfind('.'):].lower()
             if ext in ['.png', '.jpg', '.jpeg', '.webp', '.bmp', '.avif']:
+                writer = state.save_writer
+                future = writer.get_future(file_path) if writer is not None else None
+                if future is not None:
+                    try:
+                        await asyncio.wrap_future(future)
+                    except Exception:
+                        # The save failed; serve whatever is on disk instead.
+                        pass
+
                 try:
-                    image = PILImage.open(file_path)
-                    
-                    if getattr(image, '_is_decrypted', False) or getattr(image, '_is_fake', False):
-                        pnginfo_dict = image.info or {}
-                        buffered = BytesIO()
-                        
-                        target_ext = pnginfo_dict.get('as_fmt', 'png')
-                        pil_format = get_pil_format_from_ext(target_ext)
-                        target_quality = int(pnginfo_dict.get('as_q', 90))
-                        target_lossless = pnginfo_dict.get('as_l', 'False') == 'True'
-                        
-                        media_type = f"image/{target_ext if target_ext != 'jpg' else 'jpeg'}"
-                        save_kwargs = {}
-
-                        if pil_format == 'JPEG':
-                            media_type = "image/jpeg"
-                            save_kwargs['quality'] = target_quality
-                            if image.mode in ('RGBA', 'LA'):
-                                image = image.convert('RGB')
-                            save_kwargs['exif'] = get_exif_bytes(pnginfo_dict)
-                            
-                        elif pil_format == 'WEBP':
-                            media_type = "image/webp"
-                            save_kwargs['quality'] = target_quality
-                            if target_lossless:
-                                save_kwargs['lossless'] = True
-                            save_kwargs['exif'] = get_exif_bytes(pnginfo_dict)
-                            
-                        elif pil_format == 'AVIF':
-                            media_type = "image/avif"
-                            save_kwargs['quality'] = target_quality
-                            save_kwargs['exif'] = get_exif_bytes(pnginfo_dict)
-                            
-                        elif pil_format == 'PNG':
-                            media_type = "image/png"
-                            info = PngImagePlugin.PngInfo()
-                            for key in pnginfo_dict.keys():
-                                if key not in [getattr(shared.opts, 'antiseek_keyname', 's_tag'), 'e_info', 'as_fmt', 'as_q', 'as_l'] and pnginfo_dict[key]:
-                                    info.add_text(key, str(pnginfo_dict[key]))
-                            save_kwargs['pnginfo'] = info
-                        else:
-                            pil_format = "PNG"
-                            media_type = "image/png"
-
-                        image.save(buffered, format=pil_format, **save_kwargs)
-                        return Response(content=buffered.getvalue(), media_type=media_type)
-                except:
-                    pass
+                    key = get_response_key(file_path, '%dx%d' % thumb_size if thumb_size else '')
+                except OSError:
+                    return await call_next(req)
+
+                # Only responses produced here carry this ETag, so a match means
+                # the file was intercepted before and is unchanged since.
+                headers = get_response_headers(key)
+                if headers['ETag'] in req.headers.get('if-none-match', ''):
+                    metrics.inc('requests', outcome='not_modified')
+                    return Response(status_code=304, headers=headers)
+
+                try:
+                    entry = await get_http_pool().run(lookup_file, file_path)
+                except PoolFullError:
+                    metrics.inc('requests', outcome='rejected')
+                    return Response(status_code=503, headers={'Retry-After': '1'})
+                if entry is None or entry['state'] == 'plain':
+                    return await call_next(req)
+
+                cache = get_response_cache()
+                result = cache.get(key)
+                cached = result is not None
+
+                if result is None:
+                    try:
+                        with metrics.timer('render_seconds', variant='thumbnail' if thumb_size else 'full'):
+                            result = await get_http_pool().run(render_file_response, file_path, thumb_size)
+                    except PoolFullError:
+                        metrics.inc('requests', outcome='rejected')
+                        return Response(status_code=503, headers={'Retry-After': '1'})
+                    except:
+                        result = None
+
+                    if result:
+                        body, media_type = result
+                        length = body.seek(0, 2)
+                        if length <= cache.budget:
+                            body.seek(0)
+                            result = (body.read(), media_type)
+                            body.close()
+                            cache.put(key, result, length)
+
+                if result:
+                    metrics.inc('requests', outcome='cached' if cached else 'rendered')
+                    return stream_response(req, result[0], result[1], headers)
         
         return await call_next(req)
 
+BATCH_MAX_FILES = 1000
+BATCH_FORMATS = ('png', 'jpg', 'jpeg', 'webp', 'avif')
+OUTPUT_DIR_OPTS = ('outdir_samples', 'outdir_txt2img_samples', 'outdir_img2img_samples', 'outdir_extras_samples', 'outdir_grids', 'outdir_txt2img_grids', 'outdir_img2img_grids', 'outdir_save', 'outdir_init_images')
+
+class BatchRequest(BaseModel):
+    paths: List[str] = []
+    folder: Optional[str] = None
+    recursive: bool = False
+    format: Optional[str] = None
+
+class IndexScanRequest(BaseModel):
+    folder: Optional[str] = None
+    recursive: bool = True
+
+class BatchError(ValueError):
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+def get_output_roots():
+    roots = [os.path.realpath('outputs')]
+    for name in OUTPUT_DIR_OPTS:
+        path = getattr(shared.opts, name, '')
+        if path:
+            roots.append(os.path.realpath(path))
+    return roots
+
+def get_output_root(file_path, roots):
+    real = os.path.realpath(file_path)
+    for root in roots:
+        if real == root or real.startswith(root.rstrip(os.sep) + os.sep):
+            return root
+    return None
+
+def collect_batch_files(batch: BatchRequest):
+    # Only files under the WebUI's output directories can be exported, and
+    # at most BATCH_MAX_FILES of them per request.
+    roots = get_output_roots()
+    candidates = list(batch.paths)
+    if batch.folder:
+        if get_output_root(batch.folder, roots) is None or not os.path.isdir(batch.folder):
+            raise BatchError(f"folder is not an output directory: {batch.folder}")
+        for root, dirs, files in os.walk(batch.folder):
+            candidates.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(IMAGE_EXTS))
+            if not batch.recursive or len(candidates) > BATCH_MAX_FILES:
+                break
+    if len(candidates) > BATCH_MAX_FILES:
+        raise BatchError(f"too many files: more than {BATCH_MAX_FILES}", 413)
+
+    files, seen = [], set()
+    for path in candidates:
+        root = get_output_root(path, roots)
+        if root is None or not os.path.isfile(path) or not path.lower().endswith(IMAGE_EXTS):
+            raise BatchError(f"not an image in an output directory: {path}")
+        real = os.path.realpath(path)
+        if real not in seen:
+            seen.add(real)
+            files.append((path, os.path.relpath(real, os.path.dirname(root))))
+    if len(files) > BATCH_MAX_FILES:
+        raise BatchError(f"too many files: more than {BATCH_MAX_FILES}", 413)
+    return files
+
+def render_batch_item(file_path, target_fmt=None):
+    wait_for_save(file_path)
+    image = PILImage.open(file_path)
+    image.load()
+    if getattr(image, '_is_fake', False):
+        return 'failed', None, None
+
+    status = 'decrypted' if getattr(image, '_is_decrypted', False) else 'plain'
+    source_fmt = image.info.get('as_fmt') or os.path.splitext(file_path)[1][1:] or 'png'
+    payload = getattr(image, '_antiseek_bytes', None)
+    if payload is not None:
+        source_fmt = (get_payload_format(payload) or source_fmt).lower()
+    fmt = (target_fmt or source_fmt).lower()
+    if status == 'plain' and not target_fmt:
+        payload = Path(file_path).read_bytes()
+    elif payload is None or get_pil_format_from_ext(fmt) != get_pil_format_from_ext(source_fmt):
+        image, pil_format, save_kwargs = get_encode_args(image, dict(image.info, as_fmt=fmt))
+        buffered = BytesIO()
+        with metrics.timer('stage_seconds', stage='encode'):
+            image.save(buffered, format=pil_format, **save_kwargs)
+        payload = buffered.getvalue()
+    return status, payload, 'jpg' if fmt == 'jpeg' else fmt
+
+async def run_batch_item(file_path, target_fmt):
+    # Batch items go through the same pool as /file= requests, retrying
+    # instead of failing when interactive requests have filled the queue.
+    while True:
+        try:
+            return await get_http_pool().run(render_batch_item, file_path, target_fmt)
+        except PoolFullError:
+            await asyncio.sleep(0.1)
+
+async def iter_batch_zip(files, target_fmt):
+    sink = ZipStream()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED)
+    report = []
+    # A bounded window: item i+N is only started once earlier output has been
+    # handed to the client, so a stalled download holds at most N rendered
+    # payloads instead of the whole batch.
+    window = get_http_pool().config[0]
+    items = iter(files)
+    pending = set()
+
+    async def process(file_path, arcname):
+        try:
+            return file_path, arcname, await run_batch_item(file_path, target_fmt)
+        except Exception as e:
+            print(f"[Anti-Seek] Batch export failed for {file_path}: {e}")
+            return file_path, arcname, ('error', None, None)
+
+    def fill():
+        while len(pending) < window:
+            item = next(items, None)
+            if item is None:
+                return
+            pending.add(asyncio.ensure_future(process(*item)))
+
+    try:
+        fill()
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                pending.discard(task)
+                file_path, arcname, (status, payload, ext) = task.result()
+                if payload is not None:
+                    arcname = os.path.splitext(arcname)[0] + '.' + ext
+                    archive.writestr(arcname.replace(os.sep, '/'), payload)
+                    metrics.inc('bytes_served', len(payload))
+                metrics.inc('batch_items', status=status)
+                report.append({'path': file_path, 'name': arcname.replace(os.sep, '/'), 'status': status})
+                yield sink.drain()
+            fill()
+        archive.writestr('antiseek-batch.json', json.dumps(report, ensure_ascii=False, indent=1))
+        archive.close()
+        yield sink.drain()
+    finally:
+        for task in pending:
+            task.cancel()
+
+COUNT_KEEPALIVE = 30
+COUNT_MAX_WAIT = 60
+
 def app_started_callback(_: Blocks, app: FastAPI):
     app.middleware_stack = None
     hook_http_request(app)
 
-    def get_encrypted_count():
-        return {"count": getattr(shared, 'antiseek_count', 0)}
+    async def get_encrypted_count(req: Request, version: Optional[int] = None, wait: float = 0):
+        # Long-poll fallback for the UI: with ?version=N&wait=S the request is
+        # held until the count moves past version N or S seconds pass.
+        if version is not None and wait > 0:
+            await state.count_feed.wait(version, min(wait, COUNT_MAX_WAIT))
+        current = state.count_feed.version
+        headers = {'ETag': f'"{current}"', 'Cache-Control': 'no-cache'}
+        if req.headers.get('if-none-match') == headers['ETag']:
+            return Response(status_code=304, headers=headers)
+        return JSONResponse({"count": metrics.total('encrypted'), "version": current}, headers=headers)
+
+    async def post_batch(batch: BatchRequest):
+        if batch.format and batch.format.lower() not in BATCH_FORMATS:
+            return JSONResponse({"error": f"unsupported format: {batch.format}"}, status_code=400)
+        try:
+            files = await run_in_threadpool(collect_batch_files, batch)
+        except BatchError as e:
+            return JSONResponse({"error": str(e)}, status_code=e.status_code)
+        headers = {'Content-Disposition': 'attachment; filename="antiseek-batch.zip"', 'Content-Encoding': 'identity'}
+        return StreamingResponse(iter_batch_zip(files, batch.format), media_type='application/zip', headers=headers)
+
+    async def get_count_events(req: Request):
+        async def events():
+            version = None
+            while not await req.is_disconnected():
+                if version != state.count_feed.version:
+                    version = state.count_feed.version
+                    yield f"id: {version}\ndata: {json.dumps({'count': metrics.total('encrypted'), 'version': version})}\n\n"
+                else:
+                    yield ": keepalive\n\n"
+                await state.count_feed.wait(version, COUNT_KEEPALIVE)
+
+        # Content-Encoding keeps the WebUI's gzip middleware from buffering
+        # the stream; X-Accel-Buffering does the same for nginx.
+        headers = {'Cache-Control': 'no-cache', 'Content-Encoding': 'identity', 'X-Accel-Buffering': 'no'}
+        return StreamingResponse(events(), media_type='text/event-stream', headers=headers)
+
+    def get_index(folder: Optional[str] = None, state: Optional[str] = None, format: Optional[str] = None, limit: int = 100, offset: int = 0):
+        index = get_file_index()
+        if index is None:
+            return JSONResponse({"error": "index disabled"}, status_code=404)
+        key_id = get_current_key_id()
+        total, files = index.query(key_id, folder, state, format, max(1, min(limit, 1000)), max(0, offset))
+        for entry in files:
+            entry.pop('key_id', None)
+        return {"total": total, "files": files, "stats": index.stats(key_id)}
+
+    def post_index_scan(scan: IndexScanRequest):
+        index = get_file_index()
+        if index is None:
+            return JSONResponse({"error": "index disabled"}, status_code=404)
+        roots = get_output_roots()
+        if scan.folder:
+            if get_output_root(scan.folder, roots) is None or not os.path.isdir(scan.folder):
+                return JSONResponse({"error": f"folder is not an output directory: {scan.folder}"}, status_code=400)
+            folders = [scan.folder]
+        else:
+            # Settings usually point inside outputs/, which is walked once.
+            folders = sorted(root for root in set(roots) if os.path.isdir(root) and get_output_root(os.path.dirname(root), roots) is None)
+        counts = {'scanned': 0, 'unchanged': 0, 'removed': 0}
+        for folder in folders:
+            for key, value in index.scan_folder(folder, scan.recursive).items():
+                counts[key] += value
+        return counts
+
+    def get_metrics():
+        return PlainTextResponse(metrics.to_prometheus(), media_type='text/plain; version=0.0.4')
+
+    def get_metrics_json():
+        return metrics.to_json()
+
+    def get_cache_stats():
+        return dict(get_response_cache().stats(), decrypt=get_decrypt_cache().stats(), thumbnails=get_thumb_cache().stats())
 
     app.add_api_route("/antiseek/count", get_encrypted_count, methods=["GET"])
+    app.add_api_route("/antiseek/events", get_count_events, methods=["GET"])
+    app.add_api_route("/antiseek/batch", post_batch, methods=["POST"])
+    app.add_api_route("/antiseek/cache", get_cache_stats, methods=["GET"])
+    app.add_api_route("/antiseek/index", get_index, methods=["GET"])
+    app.add_api_route("/antiseek/index/scan", post_index_scan, methods=["POST"])
+    app.add_api_route("/antiseek/metrics", get_metrics, methods=["GET"], response_class=PlainTextResponse)
+    app.add_api_route("/antiseek/metrics.json", get_metrics_json, methods=["GET"])
     app.build_middleware_stack()
+    hook_sigint()
+
+def hook_sigint():
+    # The WebUI exits from its SIGINT handler without running atexit hooks,
+    # so queued saves are flushed here before handing over.
+    if threading.current_thread() is not threading.main_thread():
+        return
+    previous = signal.getsignal(signal.SIGINT)
+    if not callable(previous) or getattr(previous, '_antiseek_flush', False):
+        return
+
+    def sigint_handler(sig, frame):
+        flush_saves()
+        previous(sig, frame)
+
+    sigint_handler._antiseek_flush = True
+    signal.signal(signal.SIGINT, sigint_handler)
 
 if getattr(PILImage.Image, '__name__', '') != 'AntiSeekImage':
+    super_image = PILImage.Image
     super_open = PILImage.open
     super_encode_pil_to_base64 = api.encode_pil_to_base64
 
     class AntiSeekImage(PILImage.Image):
         __name__ = "AntiSeekImage"
+        _antiseek_source = None
+        _antiseek_path = None
+        _antiseek_bytes = None
         
         @staticmethod
         def from_image(image: PILImage.Image):
@@ -202,6 +1011,140 @@ if getattr(PILImage.Image, '__name__', '') != 'AntiSeekImage':
                     img.palette = ImagePalette.ImagePalette()
             img.info = image.info.copy()
             return img
+
+        @staticmethod
+        def lazy(image: PILImage.Image, path=None):
+            img = AntiSeekImage()
+            img._mode = image.mode
+            try:
+                img.mode = image.mode
+            except: pass
+            img._size = image.size
+            img.format = image.format
+            img.info = get_clean_info(image.info) if 'e_info' in image.info else image.info.copy()
+            img._antiseek_source = image
+            img._antiseek_path = path or getattr(image, 'filename', None)
+            return img
+
+        def _adopt(self, image: PILImage.Image):
+            image.load()
+            self.im = image.im.copy() if image.readonly else image.im
+            self._mode = image.mode
+            try:
+                self.mode = image.mode
+            except: pass
+            self._size = image.size
+            if image.mode in ("P", "PA"):
+                if image.palette:
+                    self.palette = image.palette.copy()
+                else:
+                    self.palette = ImagePalette.ImagePalette()
+            else:
+                self.palette = None
+
+        def _resolve(self):
+            source = self._antiseek_source
+            self._antiseek_source = None
+            pnginfo = source.info or {}
+
+            if 'e_info' not in pnginfo:
+                self._adopt(source)
+                return
+
+            # One verified decrypt serves every consumer of the file; a failed
+            # verification is cached as False so probes skip the decrypt too.
+            cache = get_decrypt_cache()
+            cache_key = get_decrypt_key(self._antiseek_path, pnginfo)
+            cached = cache.get(cache_key) if cache_key else None
+            if cached:
+                image, info, plain = cached
+                self._adopt(image.copy())
+                self.info = info.copy()
+                self._antiseek_bytes = plain
+                self._is_decrypted = True
+                metrics.inc('decrypted', source='cache')
+                return
+            if cached is None and get_index_state(self._antiseek_path) == 'failed':
+                cached = False
+                metrics.inc('verify_failed', source='index')
+            elif cached is False:
+                metrics.inc('verify_failed', source='cache')
+
+            verified = False
+            if cached is None:
+                try:
+                    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+                    salts = []
+
+                    if key_name in pnginfo:
+                        seed = int(pnginfo[key_name])
+                        digest = get_tag_algo(pnginfo['e_info'])
+                        pnginfo_clean = get_clean_info(pnginfo)
+
+                        # The key check rules out wrong salts from the metadata,
+                        # so they cost no pixel work at all.
+                        salts = get_salt_candidates(seed, get_keyring(), pnginfo.get(KEY_CHECK_KEY))
+                        if pnginfo.get('as_m') == 'bytes' and salts:
+                            payload = read_png_chunk(self._antiseek_path or source.fp, PAYLOAD_CHUNK)
+                            for salt in salts:
+                                plain, tag = process_bytes(payload, mix_seed(seed, salt), digest=digest, encrypt=False)
+                                if tag == pnginfo['e_info']:
+                                    with metrics.timer('stage_seconds', stage='decode'):
+                                        decoded = super_open(BytesIO(plain))
+                                        decoded.load()
+                                    self._adopt(decoded)
+                                    self.info = dict(decoded.info, **pnginfo_clean)
+                                    self._antiseek_bytes = plain
+                                    verified = True
+                                    break
+                        elif salts:
+                            with metrics.timer('stage_seconds', stage='decode'):
+                                source.load()
+                            version = int(pnginfo.get('as_v', 1))
+                            for i, salt in enumerate(salts):
+                                # Decryption overwrites target; only a file without a
+                                # key check can need a second attempt.
+                                target = source if i == len(salts) - 1 else source.copy()
+                                tag = process_image_bands(target, mix_seed(seed, salt), version, digest=digest, encrypt=False)
+                                if tag == pnginfo['e_info']:
+                                    self._adopt(target)
+                                    self.info = pnginfo_clean
+                                    verified = True
+                                    break
+
+                    index_status(self._antiseek_path, 'ok' if verified else 'failed')
+                    if verified:
+                        self._is_decrypted = True
+                        metrics.inc('decrypted', source='disk')
+                        size = self.width * self.height * len(self.getbands()) + len(self._antiseek_bytes or b'')
+                        if cache_key and size <= cache.budget:
+                            cache.put(cache_key, (self.copy(), self.info.copy(), self._antiseek_bytes), size)
+                        return
+                    metrics.inc('verify_failed', source='key_check' if key_name in pnginfo and not salts else 'disk')
+                    if cache_key:
+                        cache.put(cache_key, False, 64)
+                except:
+                    if verified:
+                        return
+
+            self._adopt(get_decoy_image(source.width, source.height))
+            self._is_fake = True
+            metrics.inc('decoys')
+
+        def load(self):
+            if getattr(self, '_antiseek_source', None) is not None:
+                self._resolve()
+            return super_image.load(self)
+
+        def close(self):
+            if getattr(self, '_antiseek_source', None) is not None:
+                self._antiseek_source.close()
+                self._antiseek_source = None
+            super_image.close(self)
+
+        def __exit__(self, *args):
+            # Image.__exit__ leaves files alone; the unresolved source holds one.
+            self.close()
             
         def save(self, fp, format=None, **params):
             filename = ""
@@ -221,33 +1164,30 @@ if getattr(PILImage.Image, '__name__', '') != 'AntiSeekImage':
                 super().save(fp, format=format, **params)
                 return
 
+            self.load()
             if 'e_info' in self.info:
                 super().save(fp, format=format, **params)
                 return
 
-            back_img = self.copy()
-            
-            orig_hash = get_image_hash(self)
-            seed = get_random_seed()
-            salt = getattr(shared.opts, 'antiseek_salt', '')
-            key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
-            
-            eff_seed = mix_seed(seed, salt)
-            encrypted = process_image(self, eff_seed)
-            self.paste(encrypted)
+            metrics.inc('encrypted', mode=getattr(shared.opts, 'antiseek_mode', 'pixels'))
+            state.count_feed.notify()
             
-            if hasattr(shared, 'antiseek_count'):
-                shared.antiseek_count += 1
-            else:
-                shared.antiseek_count = 1
+            writer = get_save_writer() if isinstance(fp, Path) or _util.is_path(fp) else None
+            dest, placeholder = filename, None
+            if writer is not None and filename.endswith('.tmp'):
+                # The WebUI's temp file: the job goes under the name it is
+                # about to be renamed to, or runs here if that is not known.
+                dest, placeholder = get_final_path(filename), filename
+                if dest is None:
+                    writer = None
             
-            self.format = PngImagePlugin.PngImageFile.format
             pnginfo = params.get('pnginfo', PngImagePlugin.PngInfo())
             if not pnginfo:
                 pnginfo = PngImagePlugin.PngInfo()
                 for key in (self.info or {}).keys():
                     if self.info[key]:
                         pnginfo.add_text(key, str(self.info[key]))
+            pnginfo = strip_antiseek_text(pnginfo)
             
             fname_str = os.path.basename(filename)
             target_fmt = getattr(shared.opts, 'samples_format', 'png')
@@ -260,78 +1200,119 @@ if getattr(PILImage.Image, '__name__', '') != 'AntiSeekImage':
             pnginfo.add_text('as_fmt', str(target_fmt))
             pnginfo.add_text('as_q', str(getattr(shared.opts, 'jpeg_quality', 80)))
             pnginfo.add_text('as_l', str(getattr(shared.opts, 'webp_lossless', False)))
+            params.update(pnginfo=pnginfo)
+            
+            if getattr(shared.opts, 'antiseek_mode', 'pixels') == 'bytes':
+                if writer is not None:
+                    writer.submit(dest, self.copy().save_bytes_encrypted, pnginfo, placeholder=placeholder)
+                else:
+                    self.save_bytes_encrypted(fp, pnginfo)
+            elif writer is not None:
+                writer.submit(dest, lambda tmp_path, image: image.save_encrypted(tmp_path, **params), self.copy(), placeholder=placeholder)
+            else:
+                self.save_encrypted(fp, **params)
+            if writer is None and (isinstance(fp, Path) or _util.is_path(fp)):
+                if filename.endswith('.tmp'):
+                    # Indexed under the final name once the WebUI renames it.
+                    state.image_save.written = filename
+                else:
+                    index_status(filename, 'ok')
+
+        def save_bytes_encrypted(self, fp, pnginfo):
+            info = decode_text_chunks(pnginfo.chunks)
+            image, pil_format, save_kwargs = get_encode_args(self, info)
+            buffered = BytesIO()
+            with metrics.timer('stage_seconds', stage='encode'):
+                image.save(buffered, format=pil_format, **save_kwargs)
             
+            seed = get_random_seed()
+            salt = getattr(shared.opts, 'antiseek_salt', '')
+            key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+            eff_seed = mix_seed(seed, salt)
+            payload, orig_hash = process_bytes(buffered.getbuffer(), eff_seed, digest=TAG_ALGO)
+            preview = make_preview(self, get_preview_limit(), seed, salt)
+            
+            container = PngImagePlugin.PngInfo()
+            for key, value in info.items():
+                if key not in ('as_q', 'as_l'):
+                    container.add_text(key, value)
+            container.add_text('as_m', 'bytes')
+            container.add_text('as_v', str(KEYSTREAM_VERSION))
+            container.add_text(key_name, str(seed))
+            container.add_text('e_info', orig_hash)
+            container.add_text(KEY_CHECK_KEY, get_key_check(eff_seed))
+            container.add(PAYLOAD_CHUNK, payload)
+            if preview:
+                container.add_text(PREVIEW_KEY, preview[0])
+                container.add(PREVIEW_CHUNK, preview[1])
+            
+            self.format = PngImagePlugin.PngImageFile.format
+            with metrics.timer('stage_seconds', stage='write'):
+                write_png(fp, PILImage.new('L', self.size), container.chunks, 9)
+
+        def save_encrypted(self, fp, preview=True, **params):
+            seed = get_random_seed()
+            salt = getattr(shared.opts, 'antiseek_salt', '')
+            key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+            
+            preview = make_preview(self, get_preview_limit(), seed, salt) if preview else None
+            eff_seed = mix_seed(seed, salt)
+            if self.mode in BAND_MODES:
+                version, digest = KEYSTREAM_VERSION, TAG_ALGO
+                back_img = None
+            else:
+                # The v1 paste round trip is lossy for these modes (e.g. '1'),
+                # so the caller's pixels are restored from a copy instead.
+                version, digest = 1, 'md5'
+                back_img = self.copy()
+            orig_hash = process_image_bands(self, eff_seed, version, digest=digest)
+            
+            self.format = PngImagePlugin.PngImageFile.format
+            pnginfo = params.get('pnginfo') or PngImagePlugin.PngInfo()
+            pnginfo.add_text('as_v', str(version))
             pnginfo.add_text(key_name, str(seed))
             pnginfo.add_text('e_info', orig_hash)
+            pnginfo.add_text(KEY_CHECK_KEY, get_key_check(eff_seed))
+            if preview:
+                pnginfo.add_text(PREVIEW_KEY, preview[0])
+                pnginfo.add(PREVIEW_CHUNK, preview[1])
             params.update(pnginfo=pnginfo)
             
-            super().save(fp, format=self.format, **params)
-            
-            self.paste(back_img)
+            compress_level = int(getattr(shared.opts, 'antiseek_compress_level', 0))
+            try:
+                with metrics.timer('stage_seconds', stage='write'):
+                    if getattr(shared.opts, 'antiseek_fast_png', True) and can_write_png(self, params):
+                        write_png(fp, self, pnginfo.chunks, compress_level)
+                    else:
+                        params.pop('optimize', None)
+                        params.update(compress_level=compress_level)
+                        super().save(fp, format=self.format, **params)
+            finally:
+                if back_img is None:
+                    process_image_bands(self, eff_seed, version)
+                else:
+                    self.paste(back_img)
 
     def open(fp, *args, **kwargs):
+        if isinstance(fp, Path) or _util.is_path(fp):
+            wait_for_save(fp)
         image = super_open(fp, *args, **kwargs)
-        pnginfo = image.info or {}
-        
-        if 'e_info' in pnginfo:
-            try:
-                key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
-                salt = getattr(shared.opts, 'antiseek_salt', '')
-                
-                if key_name in pnginfo:
-                    seed = int(pnginfo[key_name])
-                    eff_seed = mix_seed(seed, salt)
-                    decrypted = process_image(image, eff_seed)
-                    
-                    check_hash = get_image_hash(decrypted)
-                    
-                    if check_hash == pnginfo['e_info']:
-                        pnginfo_clean = image.info.copy()
-                        if key_name in pnginfo_clean: del pnginfo_clean[key_name]
-                        if 'e_info' in pnginfo_clean: del pnginfo_clean['e_info']
-                        
-                        decrypted.info = pnginfo_clean
-                        image = AntiSeekImage.from_image(image=decrypted)
-                        image._is_decrypted = True
-                        return image
-                
-                fake_img = generate_fake_image(image.width, image.height)
-                fake_img.info = image.info
-                image = AntiSeekImage.from_image(image=fake_img)
-                image._is_fake = True
-                return image
-                
-            except:
-                fake_img = generate_fake_image(image.width, image.height)
-                fake_img.info = image.info
-                image = AntiSeekImage.from_image(image=fake_img)
-                image._is_fake = True
-                return image
-                
-        return AntiSeekImage.from_image(image=image)
+        return AntiSeekImage.lazy(image)
 
     def encode_pil_to_base64(image: PILImage.Image):
         with io.BytesIO() as output_bytes:
+            image.load()
             pnginfo = image.info or {}
             
-            if 'e_info' in pnginfo:
+            if 'e_info' in pnginfo and not getattr(image, '_is_fake', False):
+                # Images opened through AntiSeekImage arrive decrypted already;
+                # anything else goes through the same cached resolve path.
                 try:
-                    key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
-                    salt = getattr(shared.opts, 'antiseek_salt', '')
-                    
-                    if key_name in pnginfo:
-                        seed = int(pnginfo[key_name])
-                        eff_seed = mix_seed(seed, salt)
-                        decrypted = process_image(image, eff_seed)
-                        
-                        if get_image_hash(decrypted) == pnginfo['e_info']:
-                            image = decrypted
-                        else:
-                            image = generate_fake_image(image.width, image.height)
-                    else:
-                        image = generate_fake_image(image.width, image.height)
-                except: 
-                     image = generate_fake_image(image.width, image.height)
+                    decrypted = AntiSeekImage.lazy(image.copy(), getattr(image, 'filename', None))
+                    decrypted.load()
+                    image = decrypted
+                except:
+                    image = get_decoy_image(image.width, image.height)
             
             target_ext = getattr(shared.opts, 'samples_format', 'png')
             if not target_ext: target_ext = 'png'
@@ -343,7 +1324,7 @@ if getattr(PILImage.Image, '__name__', '') != 'AntiSeekImage':
             save_args = {}
 
             if pil_format == 'JPEG':
-                if image.mode in ('RGBA', 'LA'):
+                if image.mode not in ('RGB', 'L', 'CMYK'):
                     image = image.convert('RGB')
                 save_args['quality'] = target_quality
                 save_args['exif'] = get_exif_bytes(image.info)
@@ -367,25 +1348,91 @@ if getattr(PILImage.Image, '__name__', '') != 'AntiSeekImage':
 
     _original_piexif_insert = piexif.insert
     
+    def rewrite_encrypted_exif(file_path, exif, parameters):
+        # An encrypted file only needs its parameters text chunk; the pixels
+        # are neither decrypted nor re-encrypted. A byte-mode payload also
+        # gets the EXIF block spliced in, which costs one XOR pass over the
+        # encoded bytes under a fresh seed but no decode or re-encode.
+        text = read_png_header(file_path)['text']
+        updates = {"parameters": parameters}
+        replace = {}
+        verified = False
+        key_name = getattr(shared.opts, 'antiseek_keyname', 's_tag') or 's_tag'
+        salts = get_keyring()
+        if text.get('as_m') == 'bytes' and key_name in text and get_pil_format_from_ext(text.get('as_fmt', 'png')) in ('JPEG', 'WEBP'):
+            old_seed = int(text[key_name])
+            payload = read_png_chunk(file_path, PAYLOAD_CHUNK)
+            for salt in get_salt_candidates(old_seed, salts, text.get(KEY_CHECK_KEY)):
+                plain, tag = process_bytes(payload, mix_seed(old_seed, salt), digest=get_tag_algo(text['e_info']), encrypt=False)
+                if tag != text['e_info']:
+                    continue
+                # The new seed is mixed with the current salt, which also
+                # moves a file found through the keyring onto it.
+                output = BytesIO()
+                _original_piexif_insert(exif, bytes(plain), output)
+                seed = get_random_seed()
+                eff_seed = mix_seed(seed, salts[0])
+                payload, tag = process_bytes(output.getbuffer(), eff_seed, digest=TAG_ALGO)
+                updates.update({key_name: str(seed), 'e_info': tag, KEY_CHECK_KEY: get_key_check(eff_seed)})
+                replace[PAYLOAD_CHUNK] = bytes(payload)
+                preview = rekey_preview(file_path, text, old_seed, salt, seed, salts[0])
+                if preview:
+                    updates[PREVIEW_KEY] = preview[0]
+                    replace[PREVIEW_CHUNK] = preview[1]
+                verified = True
+                break
+        rewrite_png_text(file_path, updates, replace)
+        return verified
+
+    def get_exif_parameters(exif):
+        user_comment = piexif.load(exif).get("Exif", {}).get(piexif.ExifIFD.UserComment)
+        return piexif.helper.UserComment.load(user_comment) if user_comment else None
+
+    def amend_queued_exif(exif, file_path):
+        # A JPEG/WEBP output still in the save queue gets its EXIF from the
+        # writer, right before it lands, so the generation thread need not
+        # wait for the encryption to finish first.
+        writer = state.save_writer
+        if writer is None:
+            return False
+        try:
+            parameters = get_exif_parameters(exif)
+        except:
+            return False
+        if not parameters:
+            return False
+
+        def amend(tmp_path):
+            with metrics.timer('stage_seconds', stage='write'):
+                rewrite_encrypted_exif(tmp_path, exif, parameters)
+
+        return writer.amend(file_path, amend)
+
     def _antiseek_piexif_insert(exif, image, **kwargs):
+        if isinstance(image, str):
+            if amend_queued_exif(exif, image):
+                return
+            wait_for_save(image)
         try:
             _original_piexif_insert(exif, image, **kwargs)
         except piexif.InvalidImageDataError:
             try:
                 if isinstance(image, str) and os.path.isfile(image):
-                    exif_dict = piexif.load(exif)
-                    user_comment = exif_dict.get("Exif", {}).get(piexif.ExifIFD.UserComment)
-                    
-                    if user_comment:
-                        parameters = piexif.helper.UserComment.load(user_comment)
-                        if parameters:
-                            with PILImage.open(image) as img_obj:
-                                info = PngImagePlugin.PngInfo()
-                                for k, v in (img_obj.info or {}).items():
-                                    info.add_text(k, str(v))
-                                info.add_text("parameters", parameters)
-                                
-                                img_obj.save(image, format="PNG", pnginfo=info)
+                    parameters = get_exif_parameters(exif)
+                    if parameters and is_encrypted_file(image):
+                        index_state = get_index_state(image)
+                        with metrics.timer('stage_seconds', stage='write'):
+                            verified = rewrite_encrypted_exif(image, exif, parameters)
+                        if verified or index_state in ('ok', 'failed'):
+                            index_status(image, 'ok' if verified else index_state)
+                    elif parameters:
+                        with PILImage.open(image) as img_obj:
+                            info = PngImagePlugin.PngInfo()
+                            for k, v in (img_obj.info or {}).items():
+                                info.add_text(k, str(v))
+                            info.add_text("parameters", parameters)
+                            
+                            img_obj.save(image, format="PNG", pnginfo=info)
             except:
                 pass
         except Exception:
@@ -399,6 +1446,10 @@ if getattr(PILImage.Image, '__name__', '') != 'AntiSeekImage':
 
 script_callbacks.on_ui_settings(on_ui_settings)
 script_callbacks.on_app_started(app_started_callback)
+script_callbacks.on_before_image_saved(on_before_image_saved)
+script_callbacks.on_image_saved(on_image_saved)
+script_callbacks.on_script_unloaded(flush_saves)
+atexit.register(flush_saves)
 
 def print_obfuscated(msg):
     charmap = {
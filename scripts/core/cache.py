@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+class LRUCache:
+    def __init__(self, budget):
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            if size > self.budget:
+                return
+            self.entries[key] = (value, size)
+            self.size += size
+            self._evict()
+
+    def resize(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _evict(self):
+        while self.size > self.budget and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.size -= size
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "budget": self.budget,
+            }
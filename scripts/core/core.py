@@ -1,7 +1,41 @@
 import numpy as np
 from PIL import Image, ImageDraw
+from concurrent.futures import ThreadPoolExecutor
 import hashlib
 import random
+import os
+from scripts.core.metrics import StageTimes
+
+BAND_BYTES = 1 << 20
+# Modes process_image_bands() works on band by band; others go through a copy.
+BAND_MODES = ('L', 'LA', 'P', 'RGB', 'RGBA')
+KEYSTREAM_VERSION = 2
+TAG_ALGO = 'b2'
+KEY_CHECK_KEY = 'as_kc'
+# b2 tag format: leaves are HASH_LEAF_BYTES byte ranges of a byte-mode file,
+# and for images whole-row bands of HASH_LEAF_BYTES rounded down to a multiple
+# of HASH_LEAF_ROWS rows (see get_leaf_rows). Every existing b2 tag depends on
+# these, so they are fixed, whatever BAND_BYTES is tuned to.
+HASH_LEAF_BYTES = 1 << 20
+HASH_LEAF_ROWS = 8
+MAX_WORKERS = os.cpu_count() or 1
+
+_executor = None
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='antiseek')
+    return _executor
+
+def set_max_workers(workers):
+    # Band threads per process. Worker processes split the cores between them
+    # instead of each starting cpu_count threads.
+    global MAX_WORKERS, _executor
+    MAX_WORKERS = max(1, workers)
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
 
 def get_random_seed():
     return int(np.random.randint(0, 4294967295, dtype=np.uint32))
@@ -13,9 +47,43 @@ def mix_seed(seed, salt):
     h = hashlib.sha256(payload.encode('utf-8')).hexdigest()
     return int(h[:8], 16)
 
+def get_key_check(eff_seed):
+    # 16 bits of a keyed digest, stored in the clear: a wrong salt is rejected
+    # from the metadata alone. That works just as well for an offline salt
+    # search: a wrong guess passes the checks of K files with probability
+    # about 2^-16K, so two or three files confirm a salt without any pixel
+    # work. The salt has to resist guessing by itself.
+    return hashlib.blake2b(str(eff_seed).encode('utf-8'), digest_size=2, person=b'antiseek-kc').hexdigest()
+
+def get_salt_candidates(seed, salts, key_check=None):
+    # Salts worth a full verification, in order. Files written before the key
+    # check existed have no as_kc, and every salt has to be tried on them.
+    if key_check is None:
+        return list(salts)
+    return [salt for salt in salts if get_key_check(mix_seed(seed, salt)) == key_check]
+
+def parse_keyring(salt, extra):
+    # The configured salt first, then the comma-separated extra salts.
+    salts = [salt]
+    for item in (extra or '').split(','):
+        item = item.strip()
+        if item and item not in salts:
+            salts.append(item)
+    return salts
+
 def get_image_hash(image):
     return hashlib.md5(image.tobytes()).hexdigest()
 
+def get_tag_algo(tag):
+    return tag.split(':', 1)[0] if ':' in tag else 'md5'
+
+def get_leaf_tag(header, seed, leaves):
+    h = hashlib.blake2b(digest_size=16, key=seed.to_bytes(8, 'little'))
+    h.update(header.encode('utf-8'))
+    for leaf in leaves:
+        h.update(leaf)
+    return 'b2:' + h.hexdigest()
+
 def process_image(image, seed):
     img_array = np.array(image)
     rng = np.random.default_rng(seed)
@@ -23,6 +91,200 @@ def process_image(image, seed):
     processed_array = np.bitwise_xor(img_array, noise)
     return Image.fromarray(processed_array)
 
+def get_band_rows(image, band_bytes=BAND_BYTES):
+    row_len = max(1, image.width * len(image.getbands()))
+    rows = max(8, band_bytes // row_len)
+    return rows - rows % 8
+
+def get_leaf_rows(image):
+    # Part of the b2 format, not a tuning knob: keep in step with the
+    # constants above, never with get_band_rows().
+    row_len = max(1, image.width * len(image.getbands()))
+    rows = max(HASH_LEAF_ROWS, HASH_LEAF_BYTES // row_len)
+    return rows - rows % HASH_LEAF_ROWS
+
+def iter_bands(image, band_rows):
+    for top in range(0, image.height, band_rows):
+        yield (0, top, image.width, min(top + band_rows, image.height))
+
+def get_keystream(seed, offset, size):
+    # v2: Philox keyed by the effective seed, addressed by a 32-byte block
+    # counter, so any byte range of the stream can be generated on its own.
+    block, skip = divmod(offset, 32)
+    raw = np.random.Philox(key=seed, counter=block).random_raw(-(-(skip + size) // 8))
+    return raw.astype('<u8', copy=False).view(np.uint8)[skip:skip + size]
+
+def get_legacy_keystream(seed):
+    # v1: same stream as process_image. default_rng draws full-range uint8 as
+    # the little-endian bytes of the raw 64-bit outputs, so bands that are a
+    # multiple of 8 bytes long can be generated in order.
+    bitgen = np.random.default_rng(seed).bit_generator
+
+    def keystream(offset, size):
+        raw = bitgen.random_raw(-(-size // 8)).astype('<u8', copy=False)
+        return raw.view(np.uint8)[:size]
+
+    return keystream
+
+def get_hasher(digest, seed):
+    # Returns a per-band leaf function and a finaliser turning the leaves into
+    # the tag. md5 is sequential and feeds a single running hash.
+    if digest == 'md5':
+        md5 = hashlib.md5()
+        return md5.update, lambda header, leaves: md5.hexdigest()
+    if digest == 'b2':
+        key = seed.to_bytes(8, 'little')
+        return (lambda band: hashlib.blake2b(band, digest_size=16, key=key).digest(),
+                lambda header, leaves: get_leaf_tag(header, seed, leaves))
+    if digest is None:
+        return None, lambda header, leaves: None
+    raise ValueError(f"unknown digest: {digest}")
+
+def get_image_keystream(seed, version):
+    if version == 1:
+        return get_legacy_keystream(seed)
+    if version == 2:
+        return lambda offset, size: get_keystream(seed, offset, size)
+    raise ValueError(f"unknown keystream version: {version}")
+
+def map_bands(fn, boxes, parallel):
+    if parallel and len(boxes) > 1:
+        return list(get_executor().map(fn, boxes))
+    return [fn(box) for box in boxes]
+
+def process_image_bands(image, seed, version=1, band_bytes=BAND_BYTES, digest=None, encrypt=True):
+    # Not in place: Pillow has no writable view of its pixels, so each row
+    # band is cropped into a new array, XORed with a keystream generated for
+    # it and pasted back. What this saves is a second full-size image; the
+    # copies and keystream buffers are per band.
+    # With digest set, the integrity tag of the plaintext is computed in the
+    # same pass: before the XOR when encrypting, after it when decrypting.
+    if image.mode not in BAND_MODES:
+        if version != 1 or digest not in (None, 'md5'):
+            raise ValueError(f"keystream v{version} does not support mode {image.mode}")
+        tag = get_image_hash(image) if digest and encrypt else None
+        image.paste(process_image(image, seed))
+        if digest and not encrypt:
+            tag = get_image_hash(image)
+        return tag
+
+    hash_leaf, finish = get_hasher(digest, seed)
+    keystream = get_image_keystream(seed, version)
+
+    image._ensure_mutable()
+    row_len = image.width * len(image.getbands())
+    # One band per b2 leaf, so the tag never depends on the banding.
+    band_rows = get_leaf_rows(image) if digest == 'b2' else get_band_rows(image, band_bytes)
+    boxes = list(iter_bands(image, band_rows))
+    stages = StageTimes()
+
+    def xor_band(box):
+        leaf = None
+        with stages('copy'):
+            band = np.array(image.crop(box))
+        if hash_leaf and encrypt:
+            with stages('hash'):
+                leaf = hash_leaf(band)
+        with stages('keystream'):
+            noise = keystream(box[1] * row_len, band.size)
+        with stages('xor'):
+            np.bitwise_xor(band, noise.reshape(band.shape), out=band)
+        if hash_leaf and not encrypt:
+            with stages('hash'):
+                leaf = hash_leaf(band)
+        size = (box[2] - box[0], box[3] - box[1])
+        with stages('copy'):
+            image.paste(Image.frombuffer(image.mode, size, band, 'raw', image.mode, 0, 1), box)
+        return leaf
+
+    leaves = map_bands(xor_band, boxes, version != 1 and digest != 'md5')
+    stages.report()
+    return finish(f"{image.mode}:{image.width}x{image.height}", leaves)
+
+def rekey_image_bands(image, old_seed, new_seed, old_version=1, old_digest='md5', new_version=KEYSTREAM_VERSION, new_digest=TAG_ALGO):
+    # Re-encrypts under a new seed in one pass: each band is decrypted with the
+    # old keystream, hashed for both tags and encrypted with the new one, so the
+    # plaintext never exists as a whole; bands are copied as in
+    # process_image_bands(). Returns (old_tag, new_tag); the caller must
+    # discard the result unless old_tag matches the stored e_info.
+    if image.mode not in BAND_MODES:
+        old_tag = process_image_bands(image, old_seed, old_version, digest=old_digest, encrypt=False)
+        new_tag = process_image_bands(image, new_seed, new_version, digest=new_digest)
+        return old_tag, new_tag
+
+    old_leaf, old_finish = get_hasher(old_digest, old_seed)
+    new_leaf, new_finish = get_hasher(new_digest, new_seed)
+    old_stream = get_image_keystream(old_seed, old_version)
+    new_stream = get_image_keystream(new_seed, new_version)
+    band_rows = get_leaf_rows(image) if 'b2' in (old_digest, new_digest) else get_band_rows(image)
+
+    image._ensure_mutable()
+    row_len = image.width * len(image.getbands())
+    boxes = list(iter_bands(image, band_rows))
+
+    def rekey_band(box):
+        band = np.array(image.crop(box))
+        offset = box[1] * row_len
+        np.bitwise_xor(band, old_stream(offset, band.size).reshape(band.shape), out=band)
+        leaves = (old_leaf(band) if old_leaf else None, new_leaf(band) if new_leaf else None)
+        np.bitwise_xor(band, new_stream(offset, band.size).reshape(band.shape), out=band)
+        size = (box[2] - box[0], box[3] - box[1])
+        image.paste(Image.frombuffer(image.mode, size, band, 'raw', image.mode, 0, 1), box)
+        return leaves
+
+    parallel = 1 not in (old_version, new_version) and 'md5' not in (old_digest, new_digest)
+    leaves = map_bands(rekey_band, boxes, parallel)
+    header = f"{image.mode}:{image.width}x{image.height}"
+    return old_finish(header, [leaf[0] for leaf in leaves]), new_finish(header, [leaf[1] for leaf in leaves])
+
+def process_bytes(data, seed, digest=None, encrypt=True):
+    # Byte mode: the v2 keystream applied to an already encoded file. Returns
+    # the transformed bytes and, with digest='b2', the tag of the plaintext.
+    if digest not in (None, 'b2'):
+        raise ValueError(f"unknown digest: {digest}")
+
+    buf = bytearray(data)
+    view = np.frombuffer(buf, dtype=np.uint8)
+    hash_leaf, finish = get_hasher(digest, seed)
+    stages = StageTimes()
+
+    def xor_chunk(offset):
+        chunk = view[offset:offset + HASH_LEAF_BYTES]
+        leaf = None
+        if hash_leaf and encrypt:
+            with stages('hash'):
+                leaf = hash_leaf(chunk)
+        with stages('keystream'):
+            noise = get_keystream(seed, offset, chunk.size)
+        with stages('xor'):
+            np.bitwise_xor(chunk, noise, out=chunk)
+        if hash_leaf and not encrypt:
+            with stages('hash'):
+                leaf = hash_leaf(chunk)
+        return leaf
+
+    leaves = map_bands(xor_chunk, range(0, len(buf), HASH_LEAF_BYTES), True)
+    stages.report()
+    return buf, finish(f"bytes:{len(buf)}", leaves)
+
+def rekey_bytes(data, old_seed, new_seed):
+    # Byte-mode counterpart of rekey_image_bands; both tags are BLAKE2b.
+    buf = bytearray(data)
+    view = np.frombuffer(buf, dtype=np.uint8)
+    old_leaf, old_finish = get_hasher('b2', old_seed)
+    new_leaf, new_finish = get_hasher('b2', new_seed)
+
+    def rekey_chunk(offset):
+        chunk = view[offset:offset + HASH_LEAF_BYTES]
+        np.bitwise_xor(chunk, get_keystream(old_seed, offset, chunk.size), out=chunk)
+        leaves = old_leaf(chunk), new_leaf(chunk)
+        np.bitwise_xor(chunk, get_keystream(new_seed, offset, chunk.size), out=chunk)
+        return leaves
+
+    leaves = map_bands(rekey_chunk, range(0, len(buf), HASH_LEAF_BYTES), True)
+    header = f"bytes:{len(buf)}"
+    return buf, old_finish(header, [leaf[0] for leaf in leaves]), new_finish(header, [leaf[1] for leaf in leaves])
+
 def generate_fake_image(width, height):
     bg_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
     img = Image.new('RGB', (width, height), bg_color)
@@ -0,0 +1,47 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from PIL import Image
+from scripts.core.core import generate_fake_image
+
+DECOY_BASE = 256
+DECOY_POOL_SIZE = 4
+DECOY_BUCKETS = 16
+DECOY_CACHE_BYTES = 32 << 20
+
+_pool = OrderedDict()
+_lock = threading.Lock()
+
+def get_decoy_bucket(width, height):
+    scale = DECOY_BASE / max(width, height, 1)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def get_decoy_base(bucket):
+    # Decoys are rendered once per aspect ratio at a small size and kept in a
+    # bounded LRU; the pool fills lazily up to DECOY_POOL_SIZE entries.
+    with _lock:
+        bases = _pool.get(bucket)
+        if bases is not None:
+            _pool.move_to_end(bucket)
+            if len(bases) >= DECOY_POOL_SIZE:
+                return bases[np.random.randint(len(bases))]
+
+    base = np.asarray(generate_fake_image(*bucket))
+    with _lock:
+        bases = _pool.setdefault(bucket, [])
+        if len(bases) < DECOY_POOL_SIZE:
+            bases.append(base)
+        while len(_pool) > DECOY_BUCKETS:
+            _pool.popitem(last=False)
+    return base
+
+def get_decoy_image(width, height):
+    base = get_decoy_base(get_decoy_bucket(width, height))
+    rng = np.random.default_rng()
+    variant = base[:, :, rng.permutation(3)] ^ rng.integers(0, 256, 3, dtype=np.uint8)
+    variant = np.roll(variant, (rng.integers(base.shape[0]), rng.integers(base.shape[1])), axis=(0, 1))
+    if rng.integers(2):
+        variant = variant[:, ::-1]
+    if rng.integers(2):
+        variant = variant[::-1]
+    return Image.fromarray(np.ascontiguousarray(variant), 'RGB').resize((width, height), Image.NEAREST)
@@ -0,0 +1,107 @@
+import os
+import threading
+from collections import OrderedDict
+
+class DiskCache:
+    # A directory of files kept under a total size, least recently used first
+    # out. Recency is the file mtime, bumped on every hit, so the order
+    # survives restarts; the directory is only walked once, on first use.
+    def __init__(self, root, budget):
+        self.root = root
+        self.budget = budget
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        found = []
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.tmp'):
+                    # Left behind by a crash mid-write.
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                    continue
+                found.append((st.st_mtime_ns, path, st.st_size))
+        found.sort()
+        self.entries = OrderedDict((path, size) for _, path, size in found)
+        self.size = sum(self.entries.values())
+        self._evict()
+
+    def hit(self, path):
+        with self.lock:
+            self._load()
+            if path in self.entries:
+                try:
+                    os.utime(path)
+                    self.entries.move_to_end(path)
+                    self.hits += 1
+                    return True
+                except OSError:
+                    # Removed behind our back.
+                    self.size -= self.entries.pop(path)
+            self.misses += 1
+            return False
+
+    def add(self, path):
+        # Records a file just written at path, replacing any older entry.
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return
+        with self.lock:
+            self._load()
+            self.size -= self.entries.pop(path, 0)
+            self.entries[path] = size
+            self.size += size
+            self._evict()
+
+    def remove(self, path):
+        with self.lock:
+            self._load()
+            self.size -= self.entries.pop(path, 0)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def resize(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._load()
+            self._evict()
+
+    def _evict(self):
+        while self.size > self.budget and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.size -= size
+            self.evicted += 1
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self.entries or ()),
+                "bytes": self.size,
+                "budget": self.budget,
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,41 @@
+import asyncio
+import threading
+
+class ChangeFeed:
+    # A version number bumped on every change. notify() may be called from any
+    # thread; waiters are asyncio futures resolved on their own event loop.
+    def __init__(self):
+        self.version = 0
+        self.lock = threading.Lock()
+        self.waiters = set()
+
+    def notify(self):
+        with self.lock:
+            self.version += 1
+            version = self.version
+            waiters, self.waiters = self.waiters, set()
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(resolve_future, future, version)
+            except RuntimeError:
+                pass
+
+    async def wait(self, version, timeout):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.lock:
+            if self.version != version:
+                return self.version
+            waiter = (loop, future)
+            self.waiters.add(waiter)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return self.version
+        finally:
+            with self.lock:
+                self.waiters.discard(waiter)
+
+def resolve_future(future, version):
+    if not future.done():
+        future.set_result(version)
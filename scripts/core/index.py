@@ -0,0 +1,244 @@
+import functools
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from PIL import Image
+from scripts.core.png import read_png_header
+
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.avif')
+COLUMNS = ('path', 'mtime_ns', 'size', 'width', 'height', 'encrypted', 'text_keys', 'e_info', 'as_fmt', 'as_m', 'as_v', 'status', 'key_id', 'checked')
+
+# Bumped whenever the table or the key_id derivation changes; the index is a
+# cache, so an older one is dropped and rebuilt rather than migrated.
+SCHEMA_VERSION = 3
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    width INTEGER,
+    height INTEGER,
+    encrypted INTEGER NOT NULL,
+    text_keys TEXT,
+    e_info TEXT,
+    as_fmt TEXT,
+    as_m TEXT,
+    as_v INTEGER,
+    status TEXT NOT NULL DEFAULT 'unknown',
+    key_id TEXT,
+    checked REAL
+);
+CREATE INDEX IF NOT EXISTS files_encrypted ON files (encrypted, key_id);
+'''
+
+# Verification only holds for the salt and key name it was done with (both are
+# in key_id), so the stored status is reported as 'unknown' once either
+# changes. Only an actual decrypt attempt ever records 'failed'.
+STATE_SQL = '''CASE
+    WHEN encrypted = 0 THEN 'plain'
+    WHEN key_id = :key_id THEN status
+    ELSE 'unknown' END'''
+
+@functools.lru_cache(maxsize=8)
+def get_key_id(salt, key_name):
+    # Only a digest of the salt is stored, never the salt itself. It is
+    # stretched, as the index sits next to the outputs and must not become a
+    # cheap way to test salt guesses; cached, as it is needed per request.
+    return hashlib.pbkdf2_hmac('sha256', f"{salt}\0{key_name}".encode('utf-8'), b'antiseek-index', 200000).hex()[:16]
+
+def get_text_keys(entry):
+    # Every text key in the header; which one holds the seed depends on the
+    # key name setting, so that is resolved by the reader, not stored.
+    return entry['text_keys'].split('\n') if entry.get('text_keys') else []
+
+def read_file_entry(path, st=None):
+    # Header-only: PNG text chunks up to the first IDAT, or the size from the
+    # image header for other formats. No pixel data is decoded.
+    st = st or os.stat(path)
+    entry = {'path': os.path.abspath(path), 'mtime_ns': st.st_mtime_ns, 'size': st.st_size, 'width': None, 'height': None,
+             'encrypted': 0, 'text_keys': None, 'e_info': None, 'as_fmt': None, 'as_m': None, 'as_v': None, 'status': 'unknown', 'key_id': None, 'checked': None}
+    header = read_png_header(path)
+    if header is not None:
+        text = header['text']
+        entry.update(width=header['width'], height=header['height'])
+        if 'e_info' in text:
+            entry.update(encrypted=1, text_keys='\n'.join(text), e_info=text['e_info'], as_fmt=text.get('as_fmt'), as_m=text.get('as_m'))
+            try:
+                entry['as_v'] = int(text.get('as_v', 1))
+            except ValueError:
+                pass
+        return entry
+    try:
+        with Image.open(path) as image:
+            entry['width'], entry['height'] = image.size
+    except:
+        pass
+    return entry
+
+class FileIndex:
+    # One connection shared by the server threads. WAL lets the CLI and the
+    # WebUI use the same file concurrently. Nothing under an exclude folder
+    # (e.g. the thumbnail cache) is ever stored.
+    def __init__(self, path, exclude=()):
+        self.path = path
+        self.exclude = tuple(os.path.join(os.path.abspath(folder), '') for folder in exclude)
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        with self.lock:
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=NORMAL')
+            if self.conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+                self.conn.execute('DROP TABLE IF EXISTS files')
+                self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def is_excluded(self, path):
+        return bool(self.exclude) and os.path.join(os.path.abspath(path), '').startswith(self.exclude)
+
+    def get(self, path):
+        with self.lock:
+            row = self.conn.execute('SELECT * FROM files WHERE path = ?', (os.path.abspath(path),)).fetchone()
+        return dict(row) if row else None
+
+    def lookup(self, path, key_id=None):
+        # The entry for path if it matches the file on disk, with 'state'
+        # resolved for the given key. Stale or missing entries return None.
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        entry = self.get(path)
+        if entry is None or (entry['mtime_ns'], entry['size']) != (st.st_mtime_ns, st.st_size):
+            return None
+        entry['state'] = get_state(entry, key_id)
+        return entry
+
+    def scan(self, path, key_id=None, status=None):
+        # lookup(), reading the header on a miss. A status given here marks
+        # a file just written or verified under key_id.
+        entry = None if status else self.lookup(path, key_id)
+        if entry is not None:
+            return entry
+        try:
+            entry = read_file_entry(path)
+        except OSError:
+            return None
+        if status:
+            entry.update(status=status, key_id=key_id, checked=time.time())
+        if not self.is_excluded(path):
+            self.put([entry])
+        entry['state'] = get_state(entry, key_id)
+        return entry
+
+    def put(self, entries):
+        rows = [tuple(entry[column] for column in COLUMNS) for entry in entries]
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(f"INSERT OR REPLACE INTO files ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", rows)
+
+    def set_status(self, path, mtime_ns, size, status, key_id):
+        # Only applies to the version of the file that was verified.
+        with self.lock:
+            cursor = self.conn.execute('UPDATE files SET status = ?, key_id = ?, checked = ? WHERE path = ? AND mtime_ns = ? AND size = ?',
+                                       (status, key_id, time.time(), os.path.abspath(path), mtime_ns, size))
+        return cursor.rowcount > 0
+
+    def remove(self, path):
+        with self.lock:
+            self.conn.execute('DELETE FROM files WHERE path = ?', (os.path.abspath(path),))
+
+    def scan_folder(self, folder, recursive=True, batch_size=256):
+        # Incremental: only files whose mtime or size changed are read, and
+        # entries for files that disappeared are dropped.
+        folder = os.path.abspath(folder)
+        known = {row['path']: (row['mtime_ns'], row['size']) for row in self.iter_rows(folder, ('path', 'mtime_ns', 'size'))}
+        seen = set()
+        counts = {'scanned': 0, 'unchanged': 0, 'removed': 0}
+        pending = []
+        for root, dirs, files in os.walk(folder):
+            dirs[:] = [name for name in dirs if not self.is_excluded(os.path.join(root, name))]
+            for name in files:
+                if not name.lower().endswith(IMAGE_EXTS):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                seen.add(path)
+                if known.get(path) == (st.st_mtime_ns, st.st_size):
+                    counts['unchanged'] += 1
+                    continue
+                try:
+                    pending.append(read_file_entry(path, st))
+                except OSError:
+                    continue
+                counts['scanned'] += 1
+                if len(pending) >= batch_size:
+                    self.put(pending)
+                    pending = []
+            if not recursive:
+                seen.update(path for path in known if os.path.dirname(path) != folder)
+                break
+        if pending:
+            self.put(pending)
+
+        removed = [(path,) for path in known if path not in seen]
+        if removed:
+            with self.lock:
+                with self.conn:
+                    self.conn.executemany('DELETE FROM files WHERE path = ?', removed)
+        counts['removed'] = len(removed)
+        return counts
+
+    def iter_rows(self, folder=None, columns=COLUMNS):
+        sql = f"SELECT {', '.join(columns)} FROM files"
+        params = ()
+        if folder:
+            sql += ' WHERE path > ? AND path < ?'
+            prefix = os.path.join(os.path.abspath(folder), '')
+            params = (prefix, prefix + '\U0010ffff')
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [dict(row) for row in rows]
+
+    def query(self, key_id, folder=None, state=None, as_fmt=None, limit=100, offset=0):
+        where, params = [], {'key_id': key_id, 'limit': limit, 'offset': offset}
+        if folder:
+            prefix = os.path.join(os.path.abspath(folder), '')
+            where.append('path > :lo AND path < :hi')
+            params.update(lo=prefix, hi=prefix + '\U0010ffff')
+        if state:
+            where.append('state = :state')
+            params['state'] = state
+        if as_fmt:
+            where.append('as_fmt = :as_fmt')
+            params['as_fmt'] = as_fmt
+        sql = f"SELECT * FROM (SELECT *, {STATE_SQL} AS state FROM files)"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        with self.lock:
+            total = self.conn.execute(f"SELECT COUNT(*) FROM ({sql})", params).fetchone()[0]
+            rows = self.conn.execute(sql + ' ORDER BY path LIMIT :limit OFFSET :offset', params).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def stats(self, key_id):
+        with self.lock:
+            rows = self.conn.execute(f"SELECT {STATE_SQL} AS state, COUNT(*), SUM(size) FROM files GROUP BY state", {'key_id': key_id}).fetchall()
+        return {row[0]: {'files': row[1], 'bytes': row[2] or 0} for row in rows}
+
+def get_state(entry, key_id):
+    if not entry['encrypted']:
+        return 'plain'
+    if key_id is not None and entry['key_id'] == key_id:
+        return entry['status']
+    return 'unknown'
@@ -0,0 +1,159 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+class Metrics:
+    def __init__(self, prefix='antiseek'):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get(self, name, **labels):
+        with self.lock:
+            return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def total(self, name):
+        with self.lock:
+            return sum(value for (key, _), value in self.counters.items() if key == name)
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * (len(LATENCY_BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            histogram[1] += seconds
+            histogram[2] += 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def gauge(self, name, fn):
+        # Gauges are read at export time, e.g. queue depth or cache size.
+        with self.lock:
+            self.gauges[name] = fn
+
+    def read_gauges(self):
+        with self.lock:
+            gauges = list(self.gauges.items())
+        values = {}
+        for name, fn in gauges:
+            try:
+                values[name] = fn()
+            except:
+                pass
+        return values
+
+    def to_json(self):
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key: (list(h[0]), h[1], h[2]) for key, h in self.histograms.items()}
+
+        data = {'counters': {}, 'histograms': {}, 'gauges': {}}
+        for (name, labels), value in sorted(counters.items()):
+            data['counters'].setdefault(name, []).append({'labels': dict(labels), 'value': value})
+        for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+            data['histograms'].setdefault(name, []).append({
+                'labels': dict(labels),
+                'count': count,
+                'sum': total,
+                'mean': total / count if count else 0.0,
+                'buckets': {format_bound(bound): value for bound, value in zip(LATENCY_BUCKETS + (float('inf'),), cumulate(buckets))},
+            })
+        for name, value in self.read_gauges().items():
+            data['gauges'][name] = value
+        return data
+
+    def to_prometheus(self):
+        data = self.to_json()
+        lines = []
+
+        def header(name, kind, suffix=''):
+            full = f"{self.prefix}_{name}{suffix}"
+            if name in self.help:
+                lines.append(f"# HELP {full} {self.help[name]}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+
+        for name, samples in data['counters'].items():
+            full = header(name, 'counter', '_total')
+            for sample in samples:
+                lines.append(f"{full}{format_labels(sample['labels'])} {sample['value']}")
+        for name, samples in data['histograms'].items():
+            full = header(name, 'histogram')
+            for sample in samples:
+                for bound, value in sample['buckets'].items():
+                    lines.append(f"{full}_bucket{format_labels(dict(sample['labels'], le=bound))} {value}")
+                lines.append(f"{full}_sum{format_labels(sample['labels'])} {sample['sum']}")
+                lines.append(f"{full}_count{format_labels(sample['labels'])} {sample['count']}")
+        for name, value in data['gauges'].items():
+            if isinstance(value, dict):
+                full = header(name, 'gauge')
+                for key, item in value.items():
+                    if isinstance(item, (int, float)):
+                        lines.append(f"{full}{format_labels({'field': key})} {item}")
+            elif isinstance(value, (int, float)):
+                full = header(name, 'gauge')
+                lines.append(f"{full} {value}")
+        return '\n'.join(lines) + '\n'
+
+class StageTimes:
+    # Accumulates per-stage time across the bands of one operation, possibly
+    # from several threads, and reports one observation per stage at the end.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    @contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.totals[stage] = self.totals.get(stage, 0.0) + elapsed
+
+    def report(self, name='stage_seconds'):
+        for stage, total in self.totals.items():
+            metrics.observe(name, total, stage=stage)
+
+def cumulate(buckets):
+    total = 0
+    for value in buckets:
+        total += value
+        yield total
+
+def format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    items = []
+    for key, value in labels.items():
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        items.append(f'{key}="{value}"')
+    return '{' + ','.join(items) + '}'
+
+metrics = Metrics()
@@ -0,0 +1,223 @@
+import os
+import struct
+import threading
+import zlib
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TEXT_CHUNKS = (b'tEXt', b'zTXt', b'iTXt')
+COLOR_TYPES = {'L': (0, 1), 'LA': (4, 2), 'RGB': (2, 3), 'RGBA': (6, 4)}
+PILLOW_ONLY_PARAMS = ('bits', 'dpi', 'exif', 'icc_profile', 'transparency', 'save_all', 'append_images', 'default_image')
+WRITE_BAND_BYTES = 1 << 20
+COPY_BYTES = 1 << 20
+PAYLOAD_CHUNK = b'asBy'
+
+def decode_text_chunk(cid, data):
+    if cid == b'tEXt':
+        key, _, value = data.partition(b'\0')
+        return key.decode('latin-1'), value.decode('latin-1', 'replace')
+    if cid == b'zTXt':
+        key, _, rest = data.partition(b'\0')
+        return key.decode('latin-1'), zlib.decompress(rest[1:]).decode('latin-1', 'replace')
+    if cid == b'iTXt':
+        key, _, rest = data.partition(b'\0')
+        compressed, rest = rest[0], rest[2:]
+        _, _, rest = rest.partition(b'\0')
+        _, _, value = rest.partition(b'\0')
+        if compressed:
+            value = zlib.decompress(value)
+        return key.decode('latin-1'), value.decode('utf-8', 'replace')
+    return None
+
+def decode_text_chunks(chunks):
+    text = {}
+    for chunk in chunks:
+        if chunk[0] in TEXT_CHUNKS:
+            try:
+                key, value = decode_text_chunk(chunk[0], chunk[1])
+                text[key] = value
+            except:
+                pass
+    return text
+
+def get_payload_format(data):
+    # The format a byte-mode payload is really in. as_fmt only names the one
+    # asked for: the CLI keeps e.g. a BMP as it is, while the WebUI writes
+    # formats it does not encode as PNG.
+    head = bytes(data[:16])
+    if head.startswith(PNG_SIGNATURE):
+        return 'PNG'
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    if head[4:12] in (b'ftypavif', b'ftypavis'):
+        return 'AVIF'
+    if head.startswith(b'BM'):
+        return 'BMP'
+    if head.startswith(b'GIF8'):
+        return 'GIF'
+    return None
+
+def read_png_chunk(fp, cid):
+    if isinstance(fp, (str, bytes)) or hasattr(fp, '__fspath__'):
+        with open(fp, 'rb') as f:
+            return read_png_chunk(f, cid)
+
+    pos = fp.tell()
+    try:
+        fp.seek(0)
+        if fp.read(8) != PNG_SIGNATURE:
+            return None
+        while True:
+            head = fp.read(8)
+            if len(head) < 8:
+                return None
+            length, chunk_id = struct.unpack('>I4s', head)
+            if chunk_id == cid:
+                data = fp.read(length)
+                if zlib.crc32(data, zlib.crc32(chunk_id)) & 0xffffffff != struct.unpack('>I', fp.read(4))[0]:
+                    return None
+                return data
+            if chunk_id == b'IEND':
+                return None
+            fp.seek(length + 4, 1)
+    finally:
+        fp.seek(pos)
+
+def read_png_header(path, max_text=1 << 20):
+    try:
+        with open(path, 'rb') as fp:
+            if fp.read(8) != PNG_SIGNATURE:
+                return None
+            header = {'width': 0, 'height': 0, 'text': {}}
+            while True:
+                head = fp.read(8)
+                if len(head) < 8:
+                    break
+                length, cid = struct.unpack('>I4s', head)
+                if cid == b'IDAT' or cid == b'IEND':
+                    break
+                if cid == b'IHDR' or (cid in TEXT_CHUNKS and length <= max_text):
+                    data = fp.read(length)
+                    fp.seek(4, 1)
+                    if cid == b'IHDR':
+                        header['width'], header['height'] = struct.unpack('>II', data[:8])
+                    else:
+                        try:
+                            key, value = decode_text_chunk(cid, data)
+                            header['text'][key] = value
+                        except:
+                            pass
+                else:
+                    fp.seek(length + 4, 1)
+            return header
+    except OSError:
+        return None
+
+def is_encrypted_file(path):
+    header = read_png_header(path)
+    return header is not None and 'e_info' in header['text']
+
+def write_chunk(fp, cid, data):
+    fp.write(struct.pack('>I', len(data)) + cid)
+    fp.write(data)
+    fp.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(cid)) & 0xffffffff))
+
+def encode_text_chunk(key, value):
+    # Same choice as PngInfo.add_text: tEXt when latin-1 suffices, else an
+    # uncompressed iTXt.
+    try:
+        return b'tEXt', key.encode('latin-1') + b'\0' + value.encode('latin-1')
+    except UnicodeEncodeError:
+        return b'iTXt', key.encode('latin-1') + b'\0\0\0\0\0' + value.encode('utf-8')
+
+def copy_bytes(src, dst, length):
+    while length > 0:
+        data = src.read(min(length, COPY_BYTES))
+        if not data:
+            raise ValueError('truncated PNG file')
+        dst.write(data)
+        length -= len(data)
+
+def rewrite_png_text(path, text, replace=None):
+    # Replaces or adds text chunks without touching the image data: every
+    # other chunk, IDAT included, is copied verbatim, so an encrypted file
+    # keeps its seed and tag. The new chunks go right before the first IDAT.
+    # replace maps a chunk type to new contents for chunks already present.
+    replace = replace or {}
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            if src.read(8) != PNG_SIGNATURE:
+                raise ValueError('not a PNG file')
+            dst.write(PNG_SIGNATURE)
+            written = False
+            while True:
+                head = src.read(8)
+                if len(head) < 8:
+                    raise ValueError('truncated PNG file')
+                length, cid = struct.unpack('>I4s', head)
+                if cid in TEXT_CHUNKS:
+                    data = src.read(length + 4)
+                    if data.partition(b'\0')[0].decode('latin-1') not in text:
+                        dst.write(head + data)
+                    continue
+                if cid in (b'IDAT', b'IEND') and not written:
+                    for key, value in text.items():
+                        write_chunk(dst, *encode_text_chunk(key, value))
+                    written = True
+                if cid in replace:
+                    src.seek(length + 4, 1)
+                    write_chunk(dst, cid, replace[cid])
+                    continue
+                dst.write(head)
+                copy_bytes(src, dst, length + 4)
+                if cid == b'IEND':
+                    break
+        os.replace(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def can_write_png(image, params):
+    if image.mode not in COLOR_TYPES:
+        return False
+    if any(key in params for key in PILLOW_ONLY_PARAMS):
+        return False
+    return 'icc_profile' not in image.info and 'transparency' not in image.info
+
+def write_png(fp, image, chunks=(), compress_level=0):
+    # Minimal PNG writer for ciphertext: every row uses filter type 0, since
+    # XOR noise gains nothing from PNG prediction and Pillow's adaptive filter
+    # search dominates the save time at low compression levels.
+    if isinstance(fp, (str, bytes)) or hasattr(fp, '__fspath__'):
+        with open(fp, 'wb') as f:
+            return write_png(f, image, chunks, compress_level)
+
+    color_type, channels = COLOR_TYPES[image.mode]
+    width, height = image.size
+    row_len = width * channels
+    rows = max(1, WRITE_BAND_BYTES // max(1, row_len))
+
+    fp.write(PNG_SIGNATURE)
+    write_chunk(fp, b'IHDR', struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0))
+    for chunk in chunks:
+        if not (len(chunk) == 3 and chunk[2]):
+            write_chunk(fp, chunk[0], chunk[1])
+
+    compressor = zlib.compressobj(compress_level)
+    for top in range(0, height, rows):
+        bottom = min(top + rows, height)
+        band = np.zeros((bottom - top, row_len + 1), dtype=np.uint8)
+        band[:, 1:] = np.asarray(image.crop((0, top, width, bottom))).reshape(bottom - top, row_len)
+        data = compressor.compress(band)
+        if data:
+            write_chunk(fp, b'IDAT', data)
+    write_chunk(fp, b'IDAT', compressor.flush())
+
+    for chunk in chunks:
+        if len(chunk) == 3 and chunk[2]:
+            write_chunk(fp, chunk[0], chunk[1])
+    write_chunk(fp, b'IEND', b'')
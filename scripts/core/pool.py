@@ -0,0 +1,39 @@
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+class PoolFullError(RuntimeError):
+    pass
+
+class BoundedPool:
+    def __init__(self, workers, queue_limit):
+        self.config = (workers, queue_limit)
+        self.limit = workers + queue_limit
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='antiseek-http')
+
+    def acquire(self):
+        with self.lock:
+            if self.pending >= self.limit:
+                raise PoolFullError(f"{self.pending} requests already queued")
+            self.pending += 1
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+
+    async def run(self, fn, *args):
+        # The slot is given back when the work is done, not when the caller
+        # stops waiting for it: a cancelled request leaves its job running.
+        self.acquire()
+        try:
+            future = self.executor.submit(fn, *args)
+        except:
+            self.release()
+            raise
+        future.add_done_callback(lambda _: self.release())
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
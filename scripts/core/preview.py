@@ -0,0 +1,73 @@
+from io import BytesIO
+from PIL import Image, features
+from scripts.core.core import process_bytes, rekey_bytes, mix_seed, get_tag_algo, TAG_ALGO
+from scripts.core.png import read_png_chunk
+
+PREVIEW_CHUNK = b'asPv'
+PREVIEW_KEY = 'as_pv'
+PREVIEW_QUALITY = 85
+MEDIA_TYPES = {'webp': 'image/webp', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+
+def get_preview_seed(seed, salt):
+    # Never equal to the image's own effective seed, so the preview and the
+    # image do not share a keystream.
+    return mix_seed(seed, f"{salt}\0preview")
+
+def get_preview_format():
+    return 'webp' if features.check('webp') else 'jpeg'
+
+def fit_size(size, box):
+    scale = min(box[0] / size[0], box[1] / size[1], 1.0)
+    return (max(1, round(size[0] * scale)), max(1, round(size[1] * scale)))
+
+def make_preview(image, limit, seed, salt):
+    # Returns the as_pv text value and the encrypted asPv chunk contents, or
+    # None when the image is not larger than the preview would be.
+    if limit <= 0 or max(image.size) <= limit:
+        return None
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA' if 'A' in image.mode or 'transparency' in image.info else 'RGB')
+    preview = image.resize(fit_size(image.size, (limit, limit)), Image.LANCZOS, reducing_gap=3.0)
+
+    fmt = get_preview_format()
+    if fmt == 'jpeg' and preview.mode == 'RGBA':
+        preview = preview.convert('RGB')
+    buffered = BytesIO()
+    Image.Image.save(preview, buffered, format=fmt.upper(), quality=PREVIEW_QUALITY)
+    payload, tag = process_bytes(buffered.getbuffer(), get_preview_seed(seed, salt), digest=TAG_ALGO)
+    return f"{fmt}:{preview.width}x{preview.height}:{tag}", bytes(payload)
+
+def parse_preview(value):
+    try:
+        fmt, size, tag = value.split(':', 2)
+        width, height = size.split('x')
+        return fmt, (int(width), int(height)), tag
+    except (AttributeError, ValueError):
+        return None
+
+def read_preview(path, text, seed, salt):
+    # The decrypted preview as (format, size, encoded bytes) if it verifies.
+    parsed = parse_preview(text.get(PREVIEW_KEY))
+    if parsed is None:
+        return None
+    fmt, size, tag = parsed
+    payload = read_png_chunk(path, PREVIEW_CHUNK)
+    if payload is None:
+        return None
+    plain, check = process_bytes(payload, get_preview_seed(seed, salt), digest=get_tag_algo(tag), encrypt=False)
+    if check != tag:
+        return None
+    return fmt, size, bytes(plain)
+
+def rekey_preview(path, text, old_seed, old_salt, new_seed, new_salt):
+    # The preview follows its image to a new seed or salt; returns the new
+    # as_pv value and chunk, or None if there is no preview or it fails.
+    parsed = parse_preview(text.get(PREVIEW_KEY))
+    payload = read_png_chunk(path, PREVIEW_CHUNK) if parsed else None
+    if payload is None:
+        return None
+    fmt, size, tag = parsed
+    payload, old_tag, new_tag = rekey_bytes(payload, get_preview_seed(old_seed, old_salt), get_preview_seed(new_seed, new_salt))
+    if old_tag != tag:
+        return None
+    return f"{fmt}:{size[0]}x{size[1]}:{new_tag}", bytes(payload)
@@ -0,0 +1,26 @@
+import os
+import threading
+from scripts.core.cache import LRUCache
+from scripts.core.decoy import DECOY_CACHE_BYTES
+from scripts.core.feed import ChangeFeed
+
+# Process-wide state. Reload UI re-executes scripts/antiseek.py, but Pillow
+# keeps the AntiSeekImage patched in by the first load; both generations look
+# these up here, in a module that is only imported once.
+count_feed = ChangeFeed()
+response_cache = LRUCache(0)
+# Keys the ETags; it only has to outlive the response cache.
+etag_secret = os.urandom(32)
+decoy_cache = LRUCache(DECOY_CACHE_BYTES)
+decrypt_cache = LRUCache(0)
+http_pool = None
+save_writer = None
+# Reentrant: the SIGINT handler flushes saves on the main thread, which may
+# be interrupted while it holds the lock.
+writer_lock = threading.RLock()
+file_index = None
+index_lock = threading.Lock()
+thumb_cache = None
+thumb_lock = threading.Lock()
+# The final name of the image the WebUI is saving on this thread.
+image_save = threading.local()
@@ -0,0 +1,68 @@
+import tempfile
+
+SPOOL_BYTES = 8 << 20
+STREAM_CHUNK = 256 << 10
+
+def make_spool():
+    return tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+
+def parse_range(value, length):
+    # Only a single byte range is supported; anything else is served in full.
+    if not value or not value.startswith('bytes=') or ',' in value:
+        return None
+    start, _, end = value[6:].strip().partition('-')
+    try:
+        if not start:
+            suffix = int(end)
+            if suffix <= 0:
+                return None
+            return max(0, length - suffix), length - 1
+        start = int(start)
+        end = min(int(end), length - 1) if end else length - 1
+    except ValueError:
+        return None
+    if start > end and start < length:
+        return None
+    return start, end
+
+def iter_body(body, start, end):
+    if isinstance(body, bytes):
+        view = memoryview(body)
+        for pos in range(start, end + 1, STREAM_CHUNK):
+            yield bytes(view[pos:min(pos + STREAM_CHUNK, end + 1)])
+        return
+
+    try:
+        body.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = body.read(min(STREAM_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        body.close()
+
+class ZipStream:
+    # Write-only sink for zipfile. Without seek() zipfile falls back to data
+    # descriptors, so each member can be drained and sent once it is written.
+    def __init__(self):
+        self.chunks = []
+        self.offset = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
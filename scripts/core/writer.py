@@ -0,0 +1,171 @@
+import os
+import queue
+import threading
+from concurrent.futures import Future
+
+# How long a job waits for the caller to move its placeholder into place
+# before it lands anyway.
+HOLD_TIMEOUT = 30
+
+class BackgroundWriter:
+    def __init__(self, workers, queue_limit, on_written=None, on_failed=None):
+        self.config = (workers, queue_limit)
+        self.on_written = on_written
+        self.on_failed = on_failed
+        self.queue = queue.Queue(maxsize=max(1, queue_limit))
+        self.jobs = {}
+        # The exception of the last failed job per path, re-raised by wait(path)
+        # until the path is submitted again.
+        self.failed = {}
+        self.cond = threading.Condition()
+        self.threads = []
+        self.closed = False
+        for i in range(max(1, workers)):
+            thread = threading.Thread(target=self._run, name=f'antiseek-writer-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, path, fn, *args, placeholder=None):
+        # Blocks while the queue is full, so a fast producer is throttled to the
+        # writers' pace instead of piling up image snapshots in memory.
+        # With a placeholder, the caller is about to rename a file from there
+        # to path (the WebUI saves to a .tmp and renames it). An empty file is
+        # left for that rename, and the job only lands once release(path) says
+        # it has happened, so neither overwrites the other.
+        job = {'dest': os.path.abspath(path), 'placeholder': None, 'released': None, 'amend': [], 'futures': [], 'landing': False}
+        if placeholder is not None:
+            job['placeholder'] = os.path.abspath(placeholder)
+            with open(job['placeholder'], 'wb'):
+                pass
+            st = os.stat(job['placeholder'])
+            job.update(inode=(st.st_dev, st.st_ino), released=threading.Event())
+        with self.cond:
+            self.jobs[job['dest']] = job
+            self.failed.pop(job['dest'], None)
+        self.queue.put((job, fn, args))
+
+    def is_pending(self, path):
+        with self.cond:
+            return os.path.abspath(path) in self.jobs
+
+    def release(self, path):
+        with self.cond:
+            job = self.jobs.get(os.path.abspath(path))
+        if job is not None and job['released'] is not None:
+            job['released'].set()
+
+    def amend(self, path, fn):
+        # Runs fn(tmp_path) on a queued file, found by its path or its
+        # placeholder, before it is moved into place. False once it is too
+        # late for that; the caller then waits and works on the file itself.
+        path = os.path.abspath(path)
+        with self.cond:
+            job = self.jobs.get(path) or next((job for job in self.jobs.values() if job['placeholder'] == path), None)
+            if job is None or job['landing']:
+                return False
+            job['amend'].append(fn)
+            return True
+
+    def get_future(self, path):
+        # A future for the queued job at path, for waiting on it without
+        # holding a thread; None when nothing is queued there. It cannot be
+        # cancelled, so one waiter giving up does not affect the others.
+        future = Future()
+        future.set_running_or_notify_cancel()
+        with self.cond:
+            job = self.jobs.get(os.path.abspath(path))
+            if job is None:
+                return None
+            job['futures'].append(future)
+        return future
+
+    def wait(self, path=None, timeout=None):
+        with self.cond:
+            if path is None:
+                return self.cond.wait_for(lambda: not self.jobs, timeout)
+            path = os.path.abspath(path)
+            done = self.cond.wait_for(lambda: path not in self.jobs, timeout)
+            if done and path in self.failed:
+                raise self.failed[path]
+            return done
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+            job, fn, args = item
+            tmp_path = f"{job['dest']}.{os.getpid()}.{threading.get_ident()}.tmp"
+            failed = None
+            try:
+                fn(tmp_path, *args)
+                if job['released'] is not None:
+                    job['released'].wait(HOLD_TIMEOUT)
+                    self._check_placeholder(job)
+                with self.cond:
+                    job['landing'] = True
+                for amend in job['amend']:
+                    amend(tmp_path)
+                os.replace(tmp_path, job['dest'])
+                if self.on_written is not None:
+                    self.on_written(job['dest'])
+            except Exception as e:
+                print(f"[Anti-Seek] background save failed for {job['dest']}: {e}")
+                failed = e
+                self._clean_up(job, tmp_path)
+                if self.on_failed is not None:
+                    self.on_failed(job['dest'])
+            finally:
+                with self.cond:
+                    if self.jobs.get(job['dest']) is job:
+                        del self.jobs[job['dest']]
+                        if failed is not None:
+                            self.failed[job['dest']] = failed
+                    self.cond.notify_all()
+                for future in job['futures']:
+                    if failed is None:
+                        future.set_result(job['dest'])
+                    else:
+                        future.set_exception(failed)
+                self.queue.task_done()
+
+    def _check_placeholder(self, job):
+        # Whatever is at dest now has to be the placeholder the caller moved
+        # there (or nothing); anything else is not ours to replace.
+        try:
+            st = os.stat(job['dest'])
+        except OSError:
+            return
+        if (st.st_dev, st.st_ino) != job['inode']:
+            raise RuntimeError(f"{job['dest']} was replaced by another file")
+
+    def _clean_up(self, job, tmp_path):
+        # Drops the partial file and the empty placeholder, wherever the
+        # caller's rename left it, once that rename is done.
+        try:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            if job['placeholder'] is None:
+                return
+            job['released'].wait(HOLD_TIMEOUT)
+            for path in (job['dest'], job['placeholder']):
+                st = os.stat(path) if os.path.exists(path) else None
+                if st is not None and (st.st_dev, st.st_ino) == job['inode']:
+                    os.remove(path)
+        except OSError:
+            pass
+
+    def flush(self):
+        self.queue.join()
+
+    def shutdown(self):
+        # Safe to repeat, e.g. from a signal handler that interrupted a shutdown.
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
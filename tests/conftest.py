@@ -0,0 +1,14 @@
+import os
+import sys
+import numpy as np
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+def make_image(width=64, height=48, mode='RGB'):
+    # Noise seeded by the size: the same image on every run, for known answers.
+    channels = len(mode)
+    shape = (height, width, channels) if channels > 1 else (height, width)
+    return Image.fromarray(np.random.default_rng(width * height).integers(0, 256, shape, dtype=np.uint8), mode)
@@ -0,0 +1,36 @@
+from scripts.core.cache import LRUCache
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(100)
+    cache.put('a', 1, 40)
+    cache.put('b', 2, 40)
+    assert cache.get('a') == 1
+    cache.put('c', 3, 40)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert cache.stats()['bytes'] == 80
+
+def test_oversized_and_replaced_entries():
+    cache = LRUCache(100)
+    cache.put('a', 1, 60)
+    cache.put('a', 2, 30)
+    assert cache.get('a') == 2 and cache.size == 30
+    # Too large for the budget: not stored, and the old value is dropped.
+    cache.put('a', 3, 200)
+    assert cache.get('a') is None and cache.size == 0
+
+def test_resize():
+    cache = LRUCache(100)
+    for key in 'abcd':
+        cache.put(key, key, 25)
+    cache.resize(50)
+    assert [cache.get(key) for key in 'abcd'] == [None, None, 'c', 'd']
+    cache.resize(0)
+    assert cache.stats()['entries'] == 0
+
+def test_false_is_a_value():
+    # The decrypt cache stores False for a failed verification.
+    cache = LRUCache(100)
+    cache.put('a', False, 1)
+    assert cache.get('a') is False
+    assert cache.stats()['hits'] == 1
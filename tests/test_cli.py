@@ -0,0 +1,52 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+from PIL import Image
+from conftest import REPO_DIR
+
+CLI_PATH = os.path.join(REPO_DIR, 'tools', 'cli.py')
+spec = importlib.util.spec_from_file_location('antiseek_cli', CLI_PATH)
+cli = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(cli)
+
+def run_cli(*args):
+    result = subprocess.run([sys.executable, CLI_PATH, *args], capture_output=True, text=True, check=True)
+    return result.stdout
+
+def read_manifest(output_dir):
+    with open(os.path.join(output_dir, cli.MANIFEST_NAME), encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+def test_run_params_cover_settings():
+    base = {'rekey': False, 'salts': ['a'], 'keyname': 's_tag', 'mode': 'pixels'}
+    assert cli.get_run_params(base) == cli.get_run_params(dict(base))
+    assert cli.get_run_params(base) != cli.get_run_params(dict(base, mode='bytes'))
+    assert cli.get_run_params(base) != cli.get_run_params(dict(base, salts=['b']))
+
+def test_is_unchanged(tmp_path):
+    src = tmp_path / 'a.png'
+    Image.new('RGB', (4, 4)).save(src)
+    st = os.stat(src)
+    entry = {'path': 'a.png', 'outcome': "Encrypted", 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'output': 'a.png', 'params': 'p'}
+    assert not cli.is_unchanged(entry, str(src), str(tmp_path / 'out'), 'p')
+    os.makedirs(tmp_path / 'out')
+    Image.new('RGB', (4, 4)).save(tmp_path / 'out' / 'a.png')
+    assert cli.is_unchanged(entry, str(src), str(tmp_path / 'out'), 'p')
+    assert not cli.is_unchanged(entry, str(src), str(tmp_path / 'out'), 'q')
+    plain = {'path': 'a.png', 'outcome': "Plain", 'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'params': 'p'}
+    assert cli.is_unchanged(plain, str(src), str(tmp_path / 'none'), 'p')
+    assert not cli.is_unchanged(dict(plain, outcome="Error"), str(src), str(tmp_path / 'none'), 'p')
+
+def test_incremental_follows_settings(tmp_path):
+    src, out = tmp_path / 'in', tmp_path / 'out'
+    os.makedirs(src)
+    Image.new('RGB', (16, 16), (10, 20, 30)).save(src / 'a.png')
+    run_cli('-i', str(src), '-o', str(out), '-s', 'x', '--incremental')
+    assert 'Skipped: 1' in run_cli('-i', str(src), '-o', str(out), '-s', 'x', '--incremental')
+    assert 'Encrypted: 1' in run_cli('-i', str(src), '-o', str(out), '-s', 'x', '-m', 'bytes', '--incremental')
+    assert 'Encrypted: 1' in run_cli('-i', str(src), '-o', str(out), '-s', 'y', '-m', 'bytes', '--incremental')
+    assert 'Plain: 1' in run_cli('-i', str(src), '-o', str(out), '-s', 'y', '--rekey', '--incremental')
+    assert 'Skipped: 1' in run_cli('-i', str(src), '-o', str(out), '-s', 'y', '--rekey', '--incremental')
+    assert len({entry['params'] for entry in read_manifest(out)}) == 4
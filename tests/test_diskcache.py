@@ -0,0 +1,38 @@
+import os
+from scripts.core.diskcache import DiskCache
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(b'\0' * size)
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), 300)
+    paths = [str(tmp_path / 'ab' / f'{i}.png') for i in range(3)]
+    for path in paths:
+        write(path, 100)
+        cache.add(path)
+    assert cache.hit(paths[0])
+    write(str(tmp_path / 'ab' / '3.png'), 100)
+    cache.add(str(tmp_path / 'ab' / '3.png'))
+    assert not os.path.exists(paths[1])
+    assert os.path.exists(paths[0])
+    assert cache.stats()['bytes'] == 300
+
+def test_loads_existing_files(tmp_path):
+    for i in range(4):
+        write(str(tmp_path / 'x' / f'{i}.png'), 100)
+    write(str(tmp_path / 'x' / '9.png.1.2.tmp'), 100)
+    cache = DiskCache(str(tmp_path), 250)
+    cache.resize(250)
+    assert cache.stats()['entries'] == 2
+    assert sorted(os.listdir(tmp_path / 'x')) == ['2.png', '3.png']
+
+def test_missing_file_is_a_miss(tmp_path):
+    path = str(tmp_path / 'a.png')
+    write(path, 10)
+    cache = DiskCache(str(tmp_path), 100)
+    cache.add(path)
+    os.remove(path)
+    assert not cache.hit(path)
+    assert cache.stats()['bytes'] == 0
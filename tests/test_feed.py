@@ -0,0 +1,27 @@
+import asyncio
+import threading
+from scripts.core.feed import ChangeFeed
+
+def test_wait_returns_on_notify():
+    feed = ChangeFeed()
+
+    async def main():
+        waiter = asyncio.ensure_future(feed.wait(0, 5))
+        await asyncio.sleep(0.01)
+        # From another thread, as the save path does.
+        threading.Thread(target=feed.notify).start()
+        return await waiter
+
+    assert asyncio.run(main()) == 1
+    assert not feed.waiters
+
+def test_wait_returns_at_once_when_behind():
+    feed = ChangeFeed()
+    feed.notify()
+    feed.notify()
+    assert asyncio.run(feed.wait(0, 5)) == 2
+
+def test_wait_times_out():
+    feed = ChangeFeed()
+    assert asyncio.run(feed.wait(0, 0.01)) == 0
+    assert not feed.waiters
@@ -0,0 +1,78 @@
+import hashlib
+import os
+from PIL import Image, PngImagePlugin
+from scripts.core.index import FileIndex, SCHEMA_VERSION, get_key_id, get_text_keys
+
+def write_png(path, text):
+    info = PngImagePlugin.PngInfo()
+    for key, value in text.items():
+        info.add_text(key, value)
+    Image.new('RGB', (8, 8)).save(path, format='PNG', pnginfo=info)
+
+def test_header_entry(tmp_path):
+    path = str(tmp_path / 'a.png')
+    write_png(path, {'batch_index': '3', 's_tag': '12345', 'e_info': 'b2:00', 'as_v': '2'})
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    entry = index.scan(path, get_key_id('salt', 's_tag'))
+    assert entry['encrypted'] == 1 and entry['as_v'] == 2
+    assert get_text_keys(entry) == ['batch_index', 's_tag', 'e_info', 'as_v']
+    assert entry['state'] == 'unknown'
+
+def test_key_name_change_is_not_a_failure(tmp_path):
+    path = str(tmp_path / 'a.png')
+    write_png(path, {'batch_index': '3', 's_tag': '12345', 'e_info': 'b2:00'})
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    key_id = get_key_id('salt', 's_tag')
+    index.scan(path, key_id, 'ok')
+    assert index.lookup(path, key_id)['state'] == 'ok'
+    assert index.lookup(path, get_key_id('salt', 'batch_index'))['state'] == 'unknown'
+    assert index.stats(get_key_id('other', 's_tag')) == {'unknown': {'files': 1, 'bytes': os.path.getsize(path)}}
+
+def test_failed_only_for_the_verified_key(tmp_path):
+    path = str(tmp_path / 'a.png')
+    write_png(path, {'s_tag': '12345', 'e_info': 'b2:00'})
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    key_id = get_key_id('salt', 's_tag')
+    st = os.stat(path)
+    index.scan(path, key_id)
+    assert index.set_status(path, st.st_mtime_ns, st.st_size, 'failed', key_id)
+    assert index.query(key_id, state='failed')[0] == 1
+    assert index.query(get_key_id('salt2', 's_tag'), state='failed')[0] == 0
+
+def test_plain_and_stale(tmp_path):
+    path = str(tmp_path / 'a.png')
+    Image.new('RGB', (8, 8)).save(path)
+    index = FileIndex(str(tmp_path / 'index.sqlite'))
+    assert index.scan(path)['state'] == 'plain'
+    write_png(path, {'s_tag': '1', 'e_info': 'b2:00', 'pad': 'x' * 64})
+    assert index.lookup(path) is None
+    assert index.scan(path)['state'] == 'unknown'
+
+def test_old_schema_is_rebuilt(tmp_path):
+    import sqlite3
+    db = str(tmp_path / 'index.sqlite')
+    conn = sqlite3.connect(db)
+    conn.execute('CREATE TABLE files (path TEXT PRIMARY KEY, key_name TEXT)')
+    conn.commit()
+    conn.close()
+    index = FileIndex(db)
+    assert index.conn.execute('PRAGMA user_version').fetchone()[0] == SCHEMA_VERSION
+    assert 'text_keys' in [row[1] for row in index.conn.execute('PRAGMA table_info(files)')]
+
+def test_key_id_is_stretched():
+    key_id = get_key_id('salt', 's_tag')
+    assert key_id == hashlib.pbkdf2_hmac('sha256', b'salt\0s_tag', b'antiseek-index', 200000).hex()[:16]
+    assert key_id != hashlib.sha1(b'salt\0s_tag').hexdigest()[:16]
+    assert get_key_id('salt', 'batch_index') != key_id
+
+def test_excluded_folder_is_not_stored(tmp_path):
+    cache = tmp_path / 'cache' / 'thumbnails'
+    os.makedirs(cache)
+    inside, outside = str(cache / 'a.png'), str(tmp_path / 'b.png')
+    write_png(inside, {'s_tag': '1', 'e_info': 'b2:00'})
+    write_png(outside, {'s_tag': '1', 'e_info': 'b2:00'})
+    index = FileIndex(str(tmp_path / 'cache' / 'index.sqlite'), exclude=(str(tmp_path / 'cache'),))
+    assert index.scan(inside, 'k', 'ok')['state'] == 'ok'
+    assert index.get(inside) is None
+    assert index.scan_folder(str(tmp_path))['scanned'] == 1
+    assert [row['path'] for row in index.iter_rows()] == [outside]
@@ -0,0 +1,449 @@
+import hashlib
+import importlib
+import io
+import json
+import os
+import sys
+import zipfile
+import piexif
+import piexif.helper
+import pytest
+from PIL import Image, PngImagePlugin
+from conftest import REPO_DIR, make_image
+
+# The whole plugin against the stubbed WebUI from benchmarks/stubs. Loading it
+# patches PIL.Image and piexif.insert; they are put back once this module is
+# done so the other test modules see the stock libraries.
+
+@pytest.fixture(scope='module')
+def plugin(tmp_path_factory):
+    os.environ['ANTISEEK_BENCH_BASEDIR'] = str(tmp_path_factory.mktemp('basedir'))
+    sys.path.insert(0, os.path.join(REPO_DIR, 'benchmarks'))
+    antiseek = importlib.import_module('harness').load_plugin()
+    yield antiseek
+    antiseek.flush_saves()
+    from modules import api
+    Image.Image = antiseek.super_image
+    Image.open = antiseek.super_open
+    api.encode_pil_to_base64 = antiseek.super_encode_pil_to_base64
+    piexif.insert = antiseek._original_piexif_insert
+
+@pytest.fixture(scope='module')
+def client(plugin):
+    from fastapi import FastAPI
+    from fastapi.responses import FileResponse
+    from fastapi.testclient import TestClient
+    from modules import script_callbacks
+    app = FastAPI()
+
+    @app.get('/file={path:path}')
+    def get_file(path: str):
+        # What the WebUI serves for anything the middleware passes through.
+        return FileResponse(path)
+
+    script_callbacks.app_started_callback(None, app)
+    return TestClient(app)
+
+@pytest.fixture(autouse=True)
+def opts(plugin, monkeypatch, tmp_path):
+    from modules import shared
+    values = {'antiseek_salt': 'test', 'antiseek_keyring': '', 'antiseek_keyname': 's_tag', 'antiseek_mode': 'pixels',
+              'antiseek_async_save': False, 'antiseek_preview_size': 0, 'antiseek_index': True, 'antiseek_thumb_cache_mb': 512,
+              'samples_format': 'png', 'outdir_samples': str(tmp_path)}
+    for key, value in values.items():
+        monkeypatch.setattr(shared.opts, key, value, raising=False)
+    return shared.opts
+
+def save_image(path, *args):
+    image = make_image(*args)
+    image.save(path)
+    return image.tobytes()
+
+def test_file_roundtrip(plugin, client, tmp_path):
+    path = str(tmp_path / 'a.png')
+    plain = save_image(path)
+    with plugin.super_open(path) as image:
+        assert 'e_info' in image.info and image.tobytes() != plain
+    with Image.open(path) as image:
+        assert 'e_info' not in image.info
+    response = client.get('/file=' + path)
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'image/png'
+    assert Image.open(io.BytesIO(response.content)).tobytes() == plain
+
+def test_file_waits_for_queued_save(plugin, client, opts, tmp_path):
+    opts.antiseek_async_save = True
+    path = str(tmp_path / 'a.png')
+    plain = save_image(path)
+    response = client.get('/file=' + path)
+    assert response.status_code == 200
+    assert Image.open(io.BytesIO(response.content)).tobytes() == plain
+
+def test_file_etag(plugin, client, tmp_path):
+    path = str(tmp_path / 'a.png')
+    save_image(path)
+    etag = client.get('/file=' + path).headers['etag']
+    # Keyed, so it cannot be checked against guessed salts offline.
+    key = plugin.get_response_key(path, '')
+    assert etag.strip('"') != hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+    response = client.get('/file=' + path, headers={'If-None-Match': etag})
+    assert response.status_code == 304 and not response.content
+
+    # The salt is part of the response, so changing it changes the ETag.
+    from modules import shared
+    shared.opts.antiseek_salt = 'other'
+    response = client.get('/file=' + path, headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['etag'] != etag
+
+@pytest.mark.parametrize('cache_mb', [256, 0])
+def test_file_range(client, opts, monkeypatch, tmp_path, cache_mb):
+    # Served from the response cache, or spooled when it is off.
+    monkeypatch.setattr(opts, 'antiseek_cache_mb', cache_mb)
+    path = str(tmp_path / 'a.png')
+    save_image(path, 300, 200)
+    full = client.get('/file=' + path).content
+    response = client.get('/file=' + path, headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.headers['content-range'] == f"bytes 100-199/{len(full)}"
+    assert response.content == full[100:200]
+    response = client.get('/file=' + path, headers={'Range': 'bytes=-10'})
+    assert response.status_code == 206 and response.content == full[-10:]
+    response = client.get('/file=' + path, headers={'Range': f"bytes={len(full)}-"})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f"bytes */{len(full)}"
+
+def test_file_range_if_range(client, tmp_path):
+    path = str(tmp_path / 'a.png')
+    save_image(path)
+    response = client.get('/file=' + path, headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert response.status_code == 200
+
+def read_zip(content):
+    archive = zipfile.ZipFile(io.BytesIO(content))
+    report = json.loads(archive.read('antiseek-batch.json'))
+    return archive, {item['name']: item['status'] for item in report}
+
+@pytest.mark.parametrize('workers', [1, 4])
+def test_batch_zip(plugin, client, opts, monkeypatch, tmp_path, workers):
+    # workers is also the render window of the archive stream.
+    monkeypatch.setattr(opts, 'antiseek_workers', workers)
+    plain = {}
+    for i in range(5):
+        plain[f"{i}.png"] = save_image(str(tmp_path / f"{i}.png"), 40 + i, 30)
+    plugin.super_image.save(make_image(20, 10), str(tmp_path / 'plain.png'))
+    paths = [str(tmp_path / name) for name in sorted(plain)] + [str(tmp_path / 'plain.png')]
+    response = client.post('/antiseek/batch', json={'paths': paths})
+    assert response.status_code == 200
+    assert response.headers['content-type'] == 'application/zip'
+    archive, report = read_zip(response.content)
+    root = tmp_path.name
+    assert report == dict({f"{root}/{name}": 'decrypted' for name in plain}, **{f"{root}/plain.png": 'plain'})
+    for name, data in plain.items():
+        assert Image.open(io.BytesIO(archive.read(f"{root}/{name}"))).tobytes() == data
+    assert archive.read(f"{root}/plain.png") == (tmp_path / 'plain.png').read_bytes()
+
+def test_batch_zip_format(client, tmp_path):
+    save_image(str(tmp_path / 'a.png'))
+    response = client.post('/antiseek/batch', json={'folder': str(tmp_path), 'format': 'webp'})
+    archive, report = read_zip(response.content)
+    assert report == {f"{tmp_path.name}/a.webp": 'decrypted'}
+    assert Image.open(io.BytesIO(archive.read(f"{tmp_path.name}/a.webp"))).format == 'WEBP'
+
+def test_batch_zip_wrong_salt(client, opts, tmp_path):
+    save_image(str(tmp_path / 'a.png'))
+    opts.antiseek_salt = 'other'
+    archive, report = read_zip(client.post('/antiseek/batch', json={'paths': [str(tmp_path / 'a.png')]}).content)
+    assert report == {f"{tmp_path.name}/a.png": 'failed'}
+    assert archive.namelist() == ['antiseek-batch.json']
+
+def test_batch_rejects(client, tmp_path, tmp_path_factory):
+    outside = tmp_path_factory.mktemp('outside')
+    save_image(str(outside / 'a.png'))
+    assert client.post('/antiseek/batch', json={'paths': [str(outside / 'a.png')]}).status_code == 400
+    assert client.post('/antiseek/batch', json={'folder': str(outside)}).status_code == 400
+    assert client.post('/antiseek/batch', json={'paths': [str(tmp_path / 'missing.png')]}).status_code == 400
+    assert client.post('/antiseek/batch', json={'paths': [], 'format': 'tiff'}).status_code == 400
+
+def test_open_is_lazy(plugin, tmp_path):
+    path = str(tmp_path / 'a.png')
+    pnginfo = PngImagePlugin.PngInfo()
+    pnginfo.add_text('parameters', 'a cat')
+    image = make_image()
+    plain = image.tobytes()
+    image.save(path, pnginfo=pnginfo)
+    with Image.open(path) as image:
+        # Size and metadata come from the header alone; the crypto keys are
+        # never exposed, so nothing downstream can copy them into a new file.
+        assert image.size == (64, 48) and image._antiseek_source is not None
+        assert image.info['parameters'] == 'a cat'
+        assert not {'e_info', 's_tag', 'as_v', 'as_kc', 'as_m', 'as_pv'} & set(image.info)
+        assert image.tobytes() == plain
+        assert image._is_decrypted and image._antiseek_source is None
+
+def test_open_closes_source(tmp_path):
+    # Left unread, the source file is still open when the with-block ends.
+    path = str(tmp_path / 'a.png')
+    make_image().save(path)
+    with Image.open(path) as image:
+        fp = image._antiseek_source.fp
+        assert not fp.closed
+    assert fp.closed and image._antiseek_source is None
+
+def test_open_v1_file(plugin, tmp_path):
+    # Written the way the plugin did before keystream versions: no as_v, no
+    # key check, an MD5 tag over the plain pixels.
+    from scripts.core.core import process_image, mix_seed, get_image_hash
+    path = str(tmp_path / 'a.png')
+    image = plugin.super_image.copy(make_image())
+    pnginfo = PngImagePlugin.PngInfo()
+    pnginfo.add_text('s_tag', '4242')
+    pnginfo.add_text('e_info', get_image_hash(image))
+    pnginfo.add_text('as_fmt', 'png')
+    plugin.super_image.save(process_image(image, mix_seed(4242, 'test')), path, pnginfo=pnginfo)
+    with Image.open(path) as opened:
+        assert opened.tobytes() == image.tobytes()
+        assert opened._is_decrypted
+
+def test_open_wrong_salt(opts, tmp_path):
+    path = str(tmp_path / 'a.png')
+    plain = save_image(path)
+    opts.antiseek_salt = 'other'
+    with Image.open(path) as image:
+        image.load()
+        assert image._is_fake and image.size == (64, 48) and image.tobytes() != plain
+
+def test_open_keyring(opts, tmp_path):
+    path = str(tmp_path / 'a.png')
+    plain = save_image(path)
+    opts.antiseek_salt = 'new'
+    opts.antiseek_keyring = 'test'
+    with Image.open(path) as image:
+        assert image.tobytes() == plain
+
+def test_resave_decrypted(tmp_path):
+    # A decrypted image saved again is encrypted afresh, not written out with
+    # the old file's tag.
+    path, copy_path = str(tmp_path / 'a.png'), str(tmp_path / 'b.png')
+    plain = save_image(path)
+    with Image.open(path) as image:
+        image.save(copy_path)
+    with Image.open(copy_path) as image:
+        assert image.tobytes() == plain and image._is_decrypted
+
+@pytest.mark.parametrize('mode, version', [('RGB', '2'), ('RGBA', '2'), ('L', '2'), ('LA', '2'), ('P', '2'), ('1', '1')])
+def test_save_keeps_pixels(plugin, tmp_path, mode, version):
+    # Encryption works on the caller's image; it must be left as it was, for
+    # the banded modes and for the ones restored from a copy.
+    path = str(tmp_path / 'a.png')
+    image = make_image(96, 64, 'RGB').convert(mode)
+    plain = image.tobytes()
+    image.save(path)
+    assert image.tobytes() == plain
+    with plugin.super_open(path) as raw:
+        assert raw.info['as_v'] == version and raw.info['e_info'].startswith('b2:') == (version == '2')
+    if version == '1':
+        # The v1 paste round trip is lossy for '1', so such files never
+        # verified; only the caller's copy is guaranteed.
+        return
+    with Image.open(path) as image:
+        assert image.mode == mode and image.tobytes() == plain
+
+@pytest.mark.parametrize('fast_png', [True, False])
+def test_save_writers_agree(opts, monkeypatch, tmp_path, fast_png):
+    monkeypatch.setattr(opts, 'antiseek_fast_png', fast_png)
+    monkeypatch.setattr(opts, 'antiseek_compress_level', 1)
+    path = str(tmp_path / 'a.png')
+    plain = save_image(path, 300, 200)
+    with Image.open(path) as image:
+        assert image.tobytes() == plain
+
+def get_exif(parameters):
+    return piexif.dump({'Exif': {piexif.ExifIFD.UserComment: piexif.helper.UserComment.dump(parameters, encoding='unicode')}})
+
+def test_exif_insert_pixels(plugin, tmp_path):
+    # The WebUI adds parameters to a saved file with piexif.insert, which
+    # cannot parse the container; only the text chunk is rewritten.
+    path = str(tmp_path / 'a.png')
+    plain = save_image(path)
+    with plugin.super_open(path) as raw:
+        seed, tag = raw.info['s_tag'], raw.info['e_info']
+    piexif.insert(get_exif('a cat'), path)
+    with plugin.super_open(path) as raw:
+        assert (raw.info['s_tag'], raw.info['e_info'], raw.info['parameters']) == (seed, tag, 'a cat')
+    with Image.open(path) as image:
+        assert image.tobytes() == plain and image.info['parameters'] == 'a cat'
+
+def test_exif_insert_bytes(plugin, client, opts, tmp_path):
+    # A byte-mode JPEG gets the EXIF block inside its payload, under a new seed.
+    opts.antiseek_mode = 'bytes'
+    opts.samples_format = 'jpg'
+    path = str(tmp_path / 'a.png')
+    save_image(path)
+    with plugin.super_open(path) as raw:
+        seed = raw.info['s_tag']
+    piexif.insert(get_exif('a cat'), path)
+    with plugin.super_open(path) as raw:
+        assert raw.info['s_tag'] != seed and raw.info['parameters'] == 'a cat'
+    response = client.get('/file=' + path)
+    assert response.headers['content-type'] == 'image/jpeg'
+    exif = piexif.load(response.content)
+    assert piexif.helper.UserComment.load(exif['Exif'][piexif.ExifIFD.UserComment]) == 'a cat'
+
+def get_thumbnail(client, path, size):
+    response = client.get(f"/infinite_image_browsing/image-thumbnail?path={path}&size={size}&t=1")
+    assert response.status_code == 200
+    return Image.open(io.BytesIO(response.content))
+
+def test_thumbnail_from_preview(plugin, client, opts, tmp_path):
+    opts.antiseek_preview_size = 128
+    path = str(tmp_path / 'a.png')
+    save_image(path, 600, 400)
+    with plugin.super_open(path) as raw:
+        assert raw.info['as_pv'].split(':')[1] == '128x85'
+    before = plugin.metrics.get('decrypted', source='preview')
+    assert get_thumbnail(client, path, '128x128').size == (128, 85)
+    assert get_thumbnail(client, path, '64x64').size == (64, 43)
+    assert plugin.metrics.get('decrypted', source='preview') == before + 2
+    # Larger than the preview: rendered from the full image instead.
+    assert get_thumbnail(client, path, '256x256').size == (256, 171)
+    assert plugin.metrics.get('decrypted', source='preview') == before + 2
+
+def test_thumbnail_cache(plugin, client, tmp_path):
+    path = str(tmp_path / 'a.png')
+    save_image(path, 600, 400)
+    thumb_path = plugin.get_thumbnail_path(path, (128, 128))
+    stats = client.get('/antiseek/cache').json()['thumbnails']
+    plugin.get_response_cache().clear()
+    assert get_thumbnail(client, path, '128x128').size == (128, 85)
+    assert os.path.isfile(thumb_path)
+    plugin.get_response_cache().clear()
+    get_thumbnail(client, path, '128x128')
+    after = client.get('/antiseek/cache').json()['thumbnails']
+    assert (after['hits'], after['misses']) == (stats['hits'] + 1, stats['misses'] + 1)
+
+    # The cache stays out of the index, and a changed source replaces its
+    # thumbnail rather than being served the old one.
+    assert plugin.get_file_index().get(thumb_path) is None
+    save_image(path, 300, 300)
+    plugin.get_response_cache().clear()
+    assert get_thumbnail(client, path, '128x128').size == (128, 128)
+
+def test_thumbnail_cache_budget(plugin, client, opts, tmp_path):
+    path = str(tmp_path / 'a.png')
+    save_image(path, 600, 400)
+    get_thumbnail(client, path, '96x96')
+    thumb_path = plugin.get_thumbnail_path(path, (96, 96))
+    assert os.path.isfile(thumb_path)
+    opts.antiseek_thumb_cache_mb = 0
+    assert client.get('/antiseek/cache').json()['thumbnails']['bytes'] == 0
+    assert not os.path.exists(thumb_path)
+    plugin.get_response_cache().clear()
+    assert get_thumbnail(client, path, '96x96').size == (96, 64)
+    assert not os.path.exists(thumb_path)
+
+def get_index_states(client, folder):
+    response = client.get('/antiseek/index', params={'folder': str(folder)})
+    assert response.status_code == 200
+    return {os.path.basename(entry['path']): entry['state'] for entry in response.json()['files']}
+
+def test_index_states(plugin, client, opts, tmp_path):
+    save_image(str(tmp_path / 'a.png'))
+    plugin.super_image.save(make_image(), str(tmp_path / 'plain.png'))
+    assert client.post('/antiseek/index/scan', json={'folder': str(tmp_path)}).json()['scanned'] == 1
+    assert get_index_states(client, tmp_path) == {'a.png': 'ok', 'plain.png': 'plain'}
+
+    # Another salt or key name has not been tried on the file yet.
+    opts.antiseek_salt = 'other'
+    assert get_index_states(client, tmp_path)['a.png'] == 'unknown'
+    with Image.open(str(tmp_path / 'a.png')) as image:
+        image.load()
+    assert get_index_states(client, tmp_path)['a.png'] == 'failed'
+    opts.antiseek_keyname = 'other_tag'
+    assert get_index_states(client, tmp_path)['a.png'] == 'unknown'
+    # Only the last verification is kept, so going back needs a new one.
+    opts.antiseek_salt, opts.antiseek_keyname = 'test', 's_tag'
+    assert get_index_states(client, tmp_path)['a.png'] == 'unknown'
+    with Image.open(str(tmp_path / 'a.png')) as image:
+        image.load()
+    assert get_index_states(client, tmp_path)['a.png'] == 'ok'
+
+def test_index_sync_save(plugin, client, opts, tmp_path):
+    # The WebUI's .tmp is indexed under the name it is renamed to.
+    from modules import images
+    for samples_format in ('png', 'jpg'):
+        opts.samples_format = samples_format
+        path = str(tmp_path / f"a.{samples_format}")
+        images.save_image(make_image(), path, 'a cat')
+        assert plugin.get_file_index().get(path)['status'] == 'ok'
+        assert plugin.get_file_index().get(str(tmp_path / 'a.tmp')) is None
+
+def test_index_async_save(plugin, client, opts, tmp_path):
+    # Queued under the final name the WebUI announced, not its .tmp, and
+    # indexed as verified once it lands there.
+    from modules import images
+    opts.antiseek_async_save = True
+    for i in range(4):
+        images.save_image(make_image(64 + i, 48), str(tmp_path / f"{i}.png"), 'a cat')
+    plugin.flush_saves()
+    assert sorted(os.listdir(tmp_path)) == [f"{i}.png" for i in range(4)]
+    assert get_index_states(client, tmp_path) == {f"{i}.png": 'ok' for i in range(4)}
+    for i in range(4):
+        with Image.open(str(tmp_path / f"{i}.png")) as image:
+            assert image.tobytes() == make_image(64 + i, 48).tobytes()
+            assert image.info['parameters'] == 'a cat'
+
+def test_flush_saves_reentrant(plugin, opts, tmp_path):
+    # The SIGINT handler runs flush_saves() on the main thread, possibly while
+    # it is inside get_save_writer().
+    from scripts.core import state
+    opts.antiseek_async_save = True
+    writer = plugin.get_save_writer()
+    with state.writer_lock:
+        writer.shutdown()
+        plugin.flush_saves()
+    assert state.save_writer is None
+
+@pytest.mark.parametrize('samples_format', ['jpg', 'webp'])
+def test_async_save_exif(plugin, opts, tmp_path, samples_format):
+    # piexif.insert on the .tmp is handed to the queued job instead of
+    # waiting for it.
+    from modules import images
+    opts.antiseek_async_save = True
+    opts.antiseek_mode = 'bytes'
+    opts.samples_format = samples_format
+    path = str(tmp_path / f"a.{samples_format}")
+    images.save_image(make_image(), path, 'a cat')
+    plugin.flush_saves()
+    with Image.open(path) as image:
+        image.load()
+        assert image.info['parameters'] == 'a cat'
+        exif = piexif.load(bytes(image._antiseek_bytes))
+        assert piexif.helper.UserComment.load(exif['Exif'][piexif.ExifIFD.UserComment]) == 'a cat'
+
+@pytest.mark.parametrize('samples_format', ['png', 'jpg', 'webp', 'bmp'])
+def test_bytes_mode(plugin, client, opts, tmp_path, samples_format):
+    # The payload is served as stored, with the type of what is actually in it.
+    opts.antiseek_mode = 'bytes'
+    opts.samples_format = samples_format
+    path = str(tmp_path / 'a.png')
+    save_image(path)
+    with plugin.super_open(path) as raw:
+        assert raw.info['as_m'] == 'bytes' and raw.size == (64, 48)
+    with Image.open(path) as image:
+        image.load()
+        assert image.size == (64, 48) and image._is_decrypted
+        payload = image._antiseek_bytes
+    response = client.get('/file=' + path)
+    assert response.content == payload
+    with Image.open(io.BytesIO(response.content)) as served:
+        assert response.headers['content-type'] == Image.MIME[served.format]
+
+def test_count(client, tmp_path):
+    first = client.get('/antiseek/count')
+    version = first.json()['version']
+    assert client.get('/antiseek/count', headers={'If-None-Match': first.headers['etag']}).status_code == 304
+    save_image(str(tmp_path / 'a.png'))
+    # Already past version: answered at once rather than after the wait.
+    response = client.get('/antiseek/count', params={'version': version, 'wait': 30})
+    assert response.json()['version'] == version + 1
+    assert response.json()['count'] == first.json()['count'] + 1
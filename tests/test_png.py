@@ -0,0 +1,123 @@
+import os
+import struct
+from io import BytesIO
+import pytest
+from PIL import Image, PngImagePlugin
+from conftest import make_image
+from scripts.core import png
+from scripts.core.png import get_payload_format, write_png, can_write_png
+
+@pytest.mark.parametrize('pil_format', ['PNG', 'JPEG', 'WEBP', 'BMP', 'GIF'])
+def test_payload_format(pil_format):
+    buffered = BytesIO()
+    Image.new('RGB', (8, 8)).save(buffered, format=pil_format)
+    assert get_payload_format(buffered.getbuffer()) == pil_format
+
+def test_payload_format_unknown():
+    assert get_payload_format(b'') is None
+    assert get_payload_format(b'not an image') is None
+
+@pytest.mark.parametrize('mode', ['L', 'LA', 'RGB', 'RGBA'])
+@pytest.mark.parametrize('compress_level', [0, 9])
+def test_write_png(monkeypatch, mode, compress_level):
+    # Small bands, so the data spans several IDAT chunks.
+    monkeypatch.setattr(png, 'WRITE_BAND_BYTES', 1000)
+    image = make_image(123, 45, mode)
+    pnginfo = PngImagePlugin.PngInfo()
+    pnginfo.add_text('e_info', 'b2:00')
+    pnginfo.add_text('prompt', '猫')
+    pnginfo.add(b'asPv', b'before')
+    pnginfo.add(b'asEx', b'after', True)
+    buffered = BytesIO()
+    write_png(buffered, image, pnginfo.chunks, compress_level)
+    buffered.seek(0)
+    with Image.open(buffered) as written:
+        written.load()
+        assert written.mode == mode and written.tobytes() == image.tobytes()
+        assert written.text == {'e_info': 'b2:00', 'prompt': '猫'}
+    assert png.read_png_chunk(buffered, b'asPv') == b'before'
+    data = buffered.getvalue()
+    assert data.index(b'asPv') < data.index(b'IDAT') < data.index(b'asEx') < data.index(b'IEND')
+
+def test_can_write_png():
+    assert can_write_png(make_image(8, 8, 'RGB'), {'pnginfo': None})
+    assert not can_write_png(make_image(8, 8, 'RGB').convert('P'), {})
+    assert not can_write_png(make_image(8, 8, 'RGB'), {'dpi': (72, 72)})
+    image = make_image(8, 8, 'RGB')
+    image.info['transparency'] = (0, 0, 0)
+    assert not can_write_png(image, {})
+
+def write_test_png(path, text, **params):
+    pnginfo = PngImagePlugin.PngInfo()
+    for key, value in text.items():
+        pnginfo.add_text(key, value, zip=key == 'zipped')
+    make_image(30, 20, 'RGB').save(path, pnginfo=pnginfo, **params)
+
+def test_read_png_header(tmp_path):
+    path = str(tmp_path / 'a.png')
+    write_test_png(path, {'e_info': 'b2:00', 'zipped': 'x' * 100, 'prompt': '猫'})
+    header = png.read_png_header(path)
+    assert (header['width'], header['height']) == (30, 20)
+    assert header['text'] == {'e_info': 'b2:00', 'zipped': 'x' * 100, 'prompt': '猫'}
+    assert png.is_encrypted_file(path)
+
+def test_read_png_header_stops_at_idat(tmp_path):
+    # Text after the image data is not worth reading the whole file for.
+    path = str(tmp_path / 'a.png')
+    image = make_image(30, 20, 'RGB')
+    with open(path, 'wb') as fp:
+        write_png(fp, image, [(b'tEXt', b'late\0value', True)])
+    assert png.read_png_header(path)['text'] == {}
+    assert not png.is_encrypted_file(path)
+
+def test_read_png_header_other_files(tmp_path):
+    path = str(tmp_path / 'a.jpg')
+    make_image(30, 20, 'RGB').save(path)
+    assert png.read_png_header(path) is None
+    assert png.read_png_header(str(tmp_path / 'missing.png')) is None
+
+def test_read_png_chunk_crc(tmp_path):
+    buffered = BytesIO()
+    write_png(buffered, make_image(8, 8, 'RGB'), [(b'asBy', b'payload')])
+    assert png.read_png_chunk(BytesIO(buffered.getvalue()), b'asBy') == b'payload'
+    assert png.read_png_chunk(BytesIO(buffered.getvalue().replace(b'payload', b'paylaod')), b'asBy') is None
+    assert png.read_png_chunk(BytesIO(buffered.getvalue()), b'asPv') is None
+
+def get_chunks(path, cid):
+    with open(path, 'rb') as fp:
+        data = fp.read()
+    chunks, pos = [], 8
+    while pos < len(data):
+        length, chunk_id = struct.unpack('>I4s', data[pos:pos + 8])
+        if chunk_id == cid:
+            chunks.append(data[pos + 8:pos + 8 + length])
+        pos += length + 12
+    return chunks
+
+def test_rewrite_png_text(tmp_path):
+    path = str(tmp_path / 'a.png')
+    write_test_png(path, {'parameters': 'old', 'e_info': 'b2:00'}, compress_level=1)
+    idat = get_chunks(path, b'IDAT')
+    png.rewrite_png_text(path, {'parameters': 'new 猫', 'added': 'yes'})
+    assert get_chunks(path, b'IDAT') == idat
+    with Image.open(path) as image:
+        assert image.text == {'e_info': 'b2:00', 'parameters': 'new 猫', 'added': 'yes'}
+        image.load()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+def test_rewrite_png_text_replace(tmp_path):
+    path = str(tmp_path / 'a.png')
+    with open(path, 'wb') as fp:
+        write_png(fp, make_image(8, 8, 'RGB'), [(b'asBy', b'old')])
+    png.rewrite_png_text(path, {'e_info': 'b2:11'}, {b'asBy': b'new payload'})
+    assert png.read_png_chunk(path, b'asBy') == b'new payload'
+    assert png.read_png_header(path)['text'] == {'e_info': 'b2:11'}
+
+def test_rewrite_png_text_not_png(tmp_path):
+    path = str(tmp_path / 'a.jpg')
+    make_image(8, 8, 'RGB').save(path)
+    data = open(path, 'rb').read()
+    with pytest.raises(ValueError):
+        png.rewrite_png_text(path, {'parameters': 'new'})
+    assert open(path, 'rb').read() == data
+    assert os.listdir(tmp_path) == ['a.jpg']
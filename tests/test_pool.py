@@ -0,0 +1,53 @@
+import asyncio
+import threading
+import pytest
+from scripts.core.pool import BoundedPool, PoolFullError
+
+def test_runs_off_the_loop():
+    pool = BoundedPool(2, 0)
+    try:
+        name = asyncio.run(pool.run(lambda: threading.current_thread().name))
+        assert name.startswith('antiseek-http')
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+def test_rejects_when_full():
+    pool = BoundedPool(1, 1)
+    release = threading.Event()
+
+    async def main():
+        jobs = [asyncio.ensure_future(pool.run(release.wait)) for _ in range(2)]
+        await asyncio.sleep(0.05)
+        with pytest.raises(PoolFullError):
+            await pool.run(release.wait)
+        release.set()
+        return await asyncio.gather(*jobs)
+
+    try:
+        assert asyncio.run(main()) == [True, True]
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
+
+def test_cancelled_caller_keeps_slot():
+    pool = BoundedPool(1, 0)
+    release = threading.Event()
+
+    async def main():
+        job = asyncio.ensure_future(pool.run(release.wait))
+        await asyncio.sleep(0.05)
+        job.cancel()
+        await asyncio.sleep(0.05)
+        # The thread is still busy, so the pool is still full.
+        with pytest.raises(PoolFullError):
+            await pool.run(release.wait)
+        release.set()
+        await asyncio.sleep(0.05)
+        return await pool.run(lambda: 'done')
+
+    try:
+        assert asyncio.run(main()) == 'done'
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
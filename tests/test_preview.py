@@ -0,0 +1,53 @@
+from io import BytesIO
+import pytest
+from PIL import Image
+from conftest import make_image
+from scripts.core.core import mix_seed
+from scripts.core.png import write_png
+from scripts.core.preview import (make_preview, read_preview, rekey_preview, parse_preview, get_preview_seed,
+                                  PREVIEW_CHUNK, PREVIEW_KEY)
+
+def write_preview(path, preview):
+    write_png(path, make_image(8, 8), [(b'tEXt', f"{PREVIEW_KEY}\0{preview[0]}".encode('latin-1')), (PREVIEW_CHUNK, preview[1])])
+    return {PREVIEW_KEY: preview[0]}
+
+def test_make_preview_skips_small_images():
+    assert make_preview(make_image(100, 80), 0, 1, 'salt') is None
+    assert make_preview(make_image(100, 80), 100, 1, 'salt') is None
+
+@pytest.mark.parametrize('mode', ['RGB', 'RGBA', 'L', 'P'])
+def test_preview_roundtrip(tmp_path, mode):
+    image = make_image(600, 400, 'RGB')
+    image = image.quantize(64) if mode == 'P' else image.convert(mode)
+    preview = make_preview(image, 128, 12345, 'salt')
+    fmt, size, tag = parse_preview(preview[0])
+    assert size == (128, 85)
+    path = str(tmp_path / 'a.png')
+    text = write_preview(path, preview)
+    result = read_preview(path, text, 12345, 'salt')
+    assert result[:2] == (fmt, size)
+    with Image.open(BytesIO(result[2])) as decoded:
+        assert decoded.size == size and decoded.format == fmt.upper()
+    assert read_preview(path, text, 12345, 'other') is None
+    assert read_preview(path, text, 12346, 'salt') is None
+
+def test_preview_seed():
+    # The preview never shares a keystream with its image.
+    assert get_preview_seed(12345, 'salt') != mix_seed(12345, 'salt')
+    assert get_preview_seed(12345, 'salt') != get_preview_seed(12345, 'other')
+
+def test_rekey_preview(tmp_path):
+    preview = make_preview(make_image(600, 400), 128, 12345, 'salt')
+    path = str(tmp_path / 'a.png')
+    text = write_preview(path, preview)
+    assert rekey_preview(path, text, 12345, 'wrong', 99, 'new') is None
+    rekeyed = rekey_preview(path, text, 12345, 'salt', 99, 'new')
+    assert parse_preview(rekeyed[0])[:2] == parse_preview(preview[0])[:2]
+    text = write_preview(path, rekeyed)
+    assert read_preview(path, text, 99, 'new') is not None
+    assert read_preview(path, text, 12345, 'salt') is None
+
+def test_parse_preview():
+    assert parse_preview('webp:128x85:b2:00') == ('webp', (128, 85), 'b2:00')
+    assert parse_preview(None) is None
+    assert parse_preview('webp:128:b2') is None
@@ -0,0 +1,49 @@
+import zipfile
+from io import BytesIO
+import pytest
+from scripts.core import stream
+from scripts.core.stream import parse_range, iter_body, ZipStream
+
+@pytest.mark.parametrize('value, expected', [
+    ('bytes=0-99', (0, 99)),
+    ('bytes=100-', (100, 999)),
+    ('bytes=-100', (900, 999)),
+    ('bytes=-5000', (0, 999)),
+    ('bytes=900-5000', (900, 999)),
+    ('bytes= 10-20', (10, 20)),
+])
+def test_parse_range(value, expected):
+    assert parse_range(value, 1000) == expected
+
+@pytest.mark.parametrize('value', [None, '', 'items=0-1', 'bytes=0-1,5-6', 'bytes=a-b', 'bytes=-0', 'bytes=20-10'])
+def test_parse_range_ignored(value):
+    # Served in full.
+    assert parse_range(value, 1000) is None
+
+def test_parse_range_unsatisfiable():
+    # Returned as is; the caller answers 416.
+    start, end = parse_range('bytes=1000-', 1000)
+    assert start >= 1000
+
+@pytest.mark.parametrize('start, end', [(0, 999), (5, 5), (100, 899)])
+def test_iter_body(monkeypatch, start, end):
+    monkeypatch.setattr(stream, 'STREAM_CHUNK', 64)
+    data = bytes(range(256)) * 4
+    assert b''.join(iter_body(data, start, end)) == data[start:end + 1]
+    body = BytesIO(data)
+    assert b''.join(iter_body(body, start, end)) == data[start:end + 1]
+    assert body.closed
+
+def test_zip_stream():
+    sink = ZipStream()
+    archive = zipfile.ZipFile(sink, 'w', zipfile.ZIP_STORED)
+    parts = []
+    for i in range(3):
+        archive.writestr(f"{i}.bin", bytes([i]) * 1000)
+        parts.append(sink.drain())
+        assert parts[-1]
+    archive.close()
+    parts.append(sink.drain())
+    assert sink.drain() == b''
+    archive = zipfile.ZipFile(BytesIO(b''.join(parts)))
+    assert [archive.read(f"{i}.bin") for i in range(3)] == [bytes([i]) * 1000 for i in range(3)]
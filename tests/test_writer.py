@@ -0,0 +1,102 @@
+import os
+import threading
+import pytest
+from scripts.core.writer import BackgroundWriter
+
+def write(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+
+def test_on_written_sees_final_path(tmp_path):
+    written = []
+    writer = BackgroundWriter(1, 4, on_written=written.append)
+    dest = str(tmp_path / 'out.tmp')
+    writer.submit(dest, write, b'x')
+    writer.shutdown()
+    assert written == [dest]
+    assert os.listdir(tmp_path) == ['out.tmp']
+
+def test_placeholder_holds_job(tmp_path):
+    # The caller renames the placeholder to dest; the job must not land
+    # before that, or the rename would replace it with the empty file.
+    written = []
+    writer = BackgroundWriter(1, 4, on_written=written.append)
+    tmp, dest = str(tmp_path / 'a.tmp'), str(tmp_path / 'a.png')
+    writer.submit(dest, write, b'a', placeholder=tmp)
+    assert os.path.getsize(tmp) == 0
+    assert not writer.wait(dest, timeout=0.1)
+    os.replace(tmp, dest)
+    writer.release(dest)
+    writer.shutdown()
+    assert written == [dest]
+    assert os.listdir(tmp_path) == ['a.png']
+    assert open(dest, 'rb').read() == b'a'
+
+def test_placeholder_never_replaces_another_file(tmp_path):
+    writer = BackgroundWriter(1, 4)
+    tmp, dest = str(tmp_path / 'a.tmp'), str(tmp_path / 'a.png')
+    writer.submit(dest, write, b'a', placeholder=tmp)
+    write(dest, b'other')
+    writer.release(dest)
+    writer.shutdown()
+    assert open(dest, 'rb').read() == b'other'
+
+def test_amend(tmp_path):
+    gate = threading.Event()
+    writer = BackgroundWriter(1, 4)
+    writer.submit(str(tmp_path / 'block'), lambda path: (gate.wait(), write(path, b'')))
+    tmp, dest = str(tmp_path / 'a.tmp'), str(tmp_path / 'a.png')
+    writer.submit(dest, write, b'a', placeholder=tmp)
+    assert writer.amend(tmp, lambda path: open(path, 'ab').write(b'+exif'))
+    assert not writer.amend(str(tmp_path / 'other.png'), lambda path: None)
+    gate.set()
+    os.replace(tmp, dest)
+    writer.release(dest)
+    writer.shutdown()
+    assert open(dest, 'rb').read() == b'a+exif'
+    assert not writer.amend(dest, lambda path: None)
+
+def fail(path):
+    write(path, b'partial')
+    raise OSError('disk full')
+
+def test_failed_save(tmp_path):
+    failed = []
+    writer = BackgroundWriter(1, 4, on_failed=failed.append)
+    dest = str(tmp_path / 'a.png')
+    writer.submit(dest, fail)
+    with pytest.raises(OSError, match='disk full'):
+        writer.wait(dest)
+    assert failed == [dest]
+    assert os.listdir(tmp_path) == []
+    # Submitting the path again forgets the failure.
+    writer.submit(dest, write, b'a')
+    assert writer.wait(dest)
+    writer.shutdown()
+    assert open(dest, 'rb').read() == b'a'
+
+def test_failed_save_drops_placeholder(tmp_path):
+    writer = BackgroundWriter(1, 4)
+    tmp, dest = str(tmp_path / 'a.tmp'), str(tmp_path / 'a.png')
+    writer.submit(dest, fail, placeholder=tmp)
+    os.replace(tmp, dest)
+    writer.release(dest)
+    with pytest.raises(OSError):
+        writer.wait(dest)
+    writer.shutdown()
+    assert os.listdir(tmp_path) == []
+
+def test_get_future(tmp_path):
+    gate = threading.Event()
+    writer = BackgroundWriter(1, 4)
+    dest, bad = str(tmp_path / 'a.png'), str(tmp_path / 'b.png')
+    writer.submit(dest, lambda path: (gate.wait(), write(path, b'a')))
+    writer.submit(bad, fail)
+    future, failed = writer.get_future(dest), writer.get_future(bad)
+    assert not future.cancel() and not future.done()
+    gate.set()
+    assert future.result(timeout=5) == dest
+    with pytest.raises(OSError):
+        failed.result(timeout=5)
+    assert writer.get_future(dest) is None
+    writer.shutdown()
@@ -1,63 +1,29 @@
 import os
 import sys
+import time
 import argparse
-import numpy as np
 import hashlib
-import random
-from concurrent.futures import ThreadPoolExecutor
-from PIL import Image, PngImagePlugin, ImageDraw
-
-def get_random_seed():
-    return int(np.random.randint(0, 4294967295, dtype=np.uint32))
-
-def mix_seed(seed, salt):
-    if not salt:
-        return seed
-    payload = f"{seed}{salt}"
-    h = hashlib.sha256(payload.encode('utf-8')).hexdigest()
-    return int(h[:8], 16)
-
-def get_image_hash(image):
-    return hashlib.md5(image.tobytes()).hexdigest()
-
-def process_image(image, seed):
-    img_array = np.array(image)
-    rng = np.random.default_rng(seed)
-    noise = rng.integers(0, 256, img_array.shape, dtype=np.uint8)
-    processed_array = np.bitwise_xor(img_array, noise)
-    return Image.fromarray(processed_array)
-
-def generate_fake_image(width, height):
-    bg_color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
-    img = Image.new('RGB', (width, height), bg_color)
-    draw = ImageDraw.Draw(img, 'RGBA')
-    
-    for _ in range(random.randint(20, 50)):
-        shape_type = random.choice(['rect', 'ellipse', 'polygon'])
-        color = (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255), random.randint(100, 255))
-        
-        if shape_type == 'rect':
-            x1 = random.randint(0, width)
-            y1 = random.randint(0, height)
-            x2 = random.randint(0, width)
-            y2 = random.randint(0, height)
-            draw.rectangle([min(x1,x2), min(y1,y2), max(x1,x2), max(y1,y2)], fill=color)
-        elif shape_type == 'ellipse':
-            x1 = random.randint(0, width)
-            y1 = random.randint(0, height)
-            x2 = random.randint(0, width)
-            y2 = random.randint(0, height)
-            draw.ellipse([min(x1,x2), min(y1,y2), max(x1,x2), max(y1,y2)], fill=color)
-        elif shape_type == 'polygon':
-            points = []
-            for _ in range(random.randint(3, 6)):
-                points.append((random.randint(0, width), random.randint(0, height)))
-            draw.polygon(points, fill=color)
-            
-    return img
+import json
+from collections import Counter
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+from PIL import Image, PngImagePlugin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def process_worker(file_path, output_dir, salt, key_name):
+from scripts.core.decoy import get_decoy_image
+from scripts.core.index import FileIndex, get_key_id, get_text_keys
+from scripts.core.preview import make_preview, rekey_preview, PREVIEW_CHUNK, PREVIEW_KEY
+from scripts.core.png import can_write_png, write_png, read_png_chunk, PAYLOAD_CHUNK
+from scripts.core.core import process_image, process_image_bands, process_bytes, rekey_image_bands, rekey_bytes, get_random_seed, mix_seed, get_image_hash, get_tag_algo, get_key_check, get_salt_candidates, parse_keyring, set_max_workers, KEYSTREAM_VERSION, TAG_ALGO, KEY_CHECK_KEY, BAND_MODES
+
+MANIFEST_NAME = '.antiseek-manifest.jsonl'
+
+def process_worker(file_path, output_dir, salt, key_name, compress_level=0, png_filter='none', encrypt_mode='pixels', preview_size=0, keyring=()):
+    record = {'path': file_path, 'outcome': "Error", 'size': 0}
     try:
+        st = os.stat(file_path)
+        record.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
         image = Image.open(file_path)
         pnginfo = image.info or {}
         
@@ -71,53 +37,302 @@ def process_worker(file_path, output_dir, salt, key_name):
             if key_name in pnginfo:
                 try:
                     seed = int(pnginfo[key_name])
-                    eff_seed = mix_seed(seed, salt)
-                    result_img = process_image(image, eff_seed)
+                    salts = get_salt_candidates(seed, [salt, *keyring], pnginfo.get(KEY_CHECK_KEY))
+                    tag = None
+                    for i, candidate in enumerate(salts):
+                        eff_seed = mix_seed(seed, candidate)
+                        if pnginfo.get('as_m') == 'bytes':
+                            result_img = None
+                            plain, tag = process_bytes(read_png_chunk(file_path, PAYLOAD_CHUNK), eff_seed, digest=get_tag_algo(pnginfo['e_info']), encrypt=False)
+                        elif image.mode in BAND_MODES:
+                            result_img = image if i == len(salts) - 1 else image.copy()
+                            version = int(pnginfo.get('as_v', 1))
+                            tag = process_image_bands(result_img, eff_seed, version, digest=get_tag_algo(pnginfo['e_info']), encrypt=False)
+                        else:
+                            result_img = process_image(image, eff_seed)
+                            tag = get_image_hash(result_img)
+                        if tag == pnginfo['e_info']:
+                            break
                     
-                    if get_image_hash(result_img) == pnginfo['e_info']:
+                    if tag == pnginfo['e_info']:
                         for key, value in pnginfo.items():
-                            if key != key_name and key != 'e_info':
+                            if key not in (key_name, 'e_info', 'as_v', 'as_m', KEY_CHECK_KEY, PREVIEW_KEY):
                                 info.add_text(key, str(value))
                         mode = "Decrypted"
                     else:
-                        result_img = generate_fake_image(image.width, image.height)
-                        mode = "Fake(HashMismatch)"
+                        result_img = get_decoy_image(image.width, image.height)
+                        mode = "Fake(HashMismatch)" if salts else "Fake(KeyCheck)"
                 except:
-                    result_img = generate_fake_image(image.width, image.height)
+                    result_img = get_decoy_image(image.width, image.height)
                     mode = "Fake(Error)"
             else:
-                result_img = generate_fake_image(image.width, image.height)
+                result_img = get_decoy_image(image.width, image.height)
                 mode = "Fake(KeyMissing)"
                 
+        elif encrypt_mode == 'bytes':
+            with open(file_path, 'rb') as f:
+                plain = f.read()
+            seed = get_random_seed()
+            eff_seed = mix_seed(seed, salt)
+            payload, orig_hash = process_bytes(plain, eff_seed, digest=TAG_ALGO)
+            preview = make_preview(image, preview_size, seed, salt)
+            
+            for key, value in pnginfo.items():
+                if isinstance(value, str):
+                    info.add_text(key, value)
+            
+            info.add_text('as_fmt', os.path.splitext(filename)[1][1:].lower() or 'png')
+            info.add_text('as_m', 'bytes')
+            info.add_text('as_v', str(KEYSTREAM_VERSION))
+            info.add_text(key_name, str(seed))
+            info.add_text('e_info', orig_hash)
+            info.add_text(KEY_CHECK_KEY, get_key_check(eff_seed))
+            info.add(PAYLOAD_CHUNK, payload)
+            if preview:
+                info.add_text(PREVIEW_KEY, preview[0])
+                info.add(PREVIEW_CHUNK, preview[1])
+            result_img = Image.new('L', image.size)
+            
+            mode = "Encrypted"
+                
         else:
-            orig_hash = get_image_hash(image)
             seed = get_random_seed()
             eff_seed = mix_seed(seed, salt)
-            result_img = process_image(image, eff_seed)
+            preview = make_preview(image, preview_size, seed, salt)
+            if image.mode in BAND_MODES:
+                version = KEYSTREAM_VERSION
+                result_img = image
+                orig_hash = process_image_bands(result_img, eff_seed, version, digest=TAG_ALGO)
+            else:
+                version = 1
+                orig_hash = get_image_hash(image)
+                result_img = process_image(image, eff_seed)
             
             for key, value in pnginfo.items():
                 info.add_text(key, str(value))
             
+            info.add_text('as_v', str(version))
             info.add_text(key_name, str(seed))
             info.add_text('e_info', orig_hash)
+            info.add_text(KEY_CHECK_KEY, get_key_check(eff_seed))
+            if preview:
+                info.add_text(PREVIEW_KEY, preview[0])
+                info.add(PREVIEW_CHUNK, preview[1])
             
             mode = "Encrypted"
 
-        result_img.save(save_path, format="PNG", pnginfo=info)
+        if result_img is None:
+            save_path = os.path.join(output_dir, name_root + '.' + pnginfo.get('as_fmt', 'png').lower())
+            with open(save_path, 'wb') as f:
+                f.write(plain)
+        elif mode != "Encrypted":
+            result_img.save(save_path, format="PNG", pnginfo=info)
+        elif encrypt_mode == 'bytes':
+            write_png(save_path, result_img, info.chunks, 9)
+        elif png_filter == 'none' and can_write_png(result_img, {}):
+            write_png(save_path, result_img, info.chunks, compress_level)
+        else:
+            result_img.save(save_path, format="PNG", pnginfo=info, compress_level=compress_level)
         print(f"[{mode}] {filename}")
-        return True
+        record.update(outcome=mode, output=os.path.basename(save_path), hash=get_file_hash(save_path))
 
     except Exception as e:
         print(f"[Error] {file_path}: {e}")
+    return record
+
+def rekey_worker(file_path, output_dir, salt, key_name, new_salt, new_key_name, compress_level=0, keyring=()):
+    record = {'path': file_path, 'outcome': "Error", 'size': 0}
+    try:
+        st = os.stat(file_path)
+        record.update(size=st.st_size, mtime_ns=st.st_mtime_ns)
+        image = Image.open(file_path)
+        pnginfo = image.info or {}
+        filename = os.path.basename(file_path)
+        save_path = os.path.join(output_dir, os.path.splitext(filename)[0] + '.png')
+        
+        if 'e_info' not in pnginfo:
+            mode = "Plain"
+        elif key_name not in pnginfo:
+            mode = "Failed(KeyMissing)"
+        else:
+            old_raw = int(pnginfo[key_name])
+            salts = get_salt_candidates(old_raw, [salt, *keyring], pnginfo.get(KEY_CHECK_KEY))
+            seed = get_random_seed()
+            new_seed = mix_seed(seed, new_salt)
+            digest = get_tag_algo(pnginfo['e_info'])
+            old_tag = None
+            
+            if pnginfo.get('as_m') == 'bytes':
+                version = KEYSTREAM_VERSION
+                chunk = read_png_chunk(file_path, PAYLOAD_CHUNK)
+            else:
+                version, new_digest = (KEYSTREAM_VERSION, TAG_ALGO) if image.mode in BAND_MODES else (1, 'md5')
+                image.load()
+                source = image
+            for i, old_salt in enumerate(salts):
+                old_seed = mix_seed(old_raw, old_salt)
+                if pnginfo.get('as_m') == 'bytes':
+                    payload, old_tag, new_tag = rekey_bytes(chunk, old_seed, new_seed)
+                else:
+                    image = source if i == len(salts) - 1 else source.copy()
+                    old_tag, new_tag = rekey_image_bands(image, old_seed, new_seed, int(pnginfo.get('as_v', 1)), digest, version, new_digest)
+                if old_tag == pnginfo['e_info']:
+                    break
+            
+            if old_tag != pnginfo['e_info']:
+                mode = "Failed(HashMismatch)" if salts else "Failed(KeyCheck)"
+            else:
+                info = PngImagePlugin.PngInfo()
+                for key, value in pnginfo.items():
+                    if isinstance(value, str) and key not in (key_name, 'e_info', 'as_v', KEY_CHECK_KEY, PREVIEW_KEY):
+                        info.add_text(key, value)
+                info.add_text('as_v', str(version))
+                info.add_text(new_key_name, str(seed))
+                info.add_text('e_info', new_tag)
+                info.add_text(KEY_CHECK_KEY, get_key_check(new_seed))
+                preview = rekey_preview(file_path, pnginfo, old_raw, old_salt, seed, new_salt)
+                if preview:
+                    info.add_text(PREVIEW_KEY, preview[0])
+                    info.add(PREVIEW_CHUNK, preview[1])
+                
+                if pnginfo.get('as_m') == 'bytes':
+                    info.add(PAYLOAD_CHUNK, payload)
+                    write_png(save_path, Image.new('L', image.size), info.chunks, 9)
+                elif can_write_png(image, {}):
+                    write_png(save_path, image, info.chunks, compress_level)
+                else:
+                    image.save(save_path, format="PNG", pnginfo=info, compress_level=compress_level)
+                record.update(output=os.path.basename(save_path), hash=get_file_hash(save_path))
+                mode = "Rekeyed"
+        
+        print(f"[{mode}] {filename}")
+        record['outcome'] = mode
+    except Exception as e:
+        print(f"[Error] {file_path}: {e}")
+    return record
+
+def get_file_hash(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_manifest(path):
+    # The manifest is appended one line per finished file, so a crash can at
+    # worst leave a truncated last line, which is skipped here.
+    entries = {}
+    if os.path.isfile(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entries[entry['path']] = entry
+                except (ValueError, KeyError):
+                    pass
+    return entries
+
+def get_run_params(options):
+    # Identifies the settings a record was made with. The salts are part of
+    # it, so the digest is stretched: the manifest sits next to the outputs
+    # and must not become a cheap way to test salt guesses.
+    payload = json.dumps(options, sort_keys=True).encode('utf-8')
+    return hashlib.pbkdf2_hmac('sha256', payload, b'antiseek-manifest', 200000).hex()[:16]
+
+def is_unchanged(entry, file_path, output_dir, params):
+    # A record only holds for the settings it was made with. Outcomes without
+    # an output (a rekey that found a plain or unverifiable file) are final
+    # for those settings; the rest also need their output to still exist.
+    if entry is None or entry.get('outcome') == "Error" or entry.get('params') != params:
+        return False
+    try:
+        st = os.stat(file_path)
+    except OSError:
+        return False
+    if (entry.get('size'), entry.get('mtime_ns')) != (st.st_size, st.st_mtime_ns):
         return False
+    return 'output' not in entry or os.path.isfile(os.path.join(output_dir, entry['output']))
+
+def iter_files(input_dir, output_dir, valid_exts):
+    for root, _, files in os.walk(input_dir):
+        if os.path.abspath(root) == os.path.abspath(output_dir):
+            continue
+            
+        for file in files:
+            if file.lower().endswith(valid_exts):
+                yield os.path.join(root, file)
+
+def run_bounded(executor, fn, items, max_inflight, *args):
+    # Feed the pool from a lazy iterator and keep at most max_inflight futures
+    # alive, so memory stays flat no matter how large the tree is.
+    pending = set()
+    for item in items:
+        if len(pending) >= max_inflight:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        pending.add(executor.submit(fn, item, *args))
+    for future in pending:
+        yield future.result()
+
+def get_index_outcome(index, file_path, key_id, key_name, rekey=False):
+    # Rekeying has nothing to do for files the index already rules out, so
+    # those are answered from their header without a decode.
+    if not rekey:
+        return None
+    entry = index.scan(file_path, key_id)
+    if entry is None:
+        return None
+    if entry['state'] == 'plain':
+        outcome = "Plain"
+    elif key_name not in get_text_keys(entry):
+        outcome = "Failed(KeyMissing)"
+    elif entry['state'] == 'failed':
+        outcome = "Failed(HashMismatch)"
+    else:
+        return None
+    print(f"[{outcome}] {os.path.basename(file_path)}")
+    return {'path': file_path, 'outcome': outcome, 'size': entry['size'], 'mtime_ns': entry['mtime_ns']}
+
+def update_index(index, record, output_dir, key_id, new_key_id):
+    outcome = record['outcome']
+    if outcome in ("Decrypted", "Rekeyed"):
+        status = 'ok'
+    elif outcome in ("Fake(HashMismatch)", "Failed(HashMismatch)", "Fake(KeyCheck)", "Failed(KeyCheck)"):
+        status = 'failed'
+    else:
+        status = None
+    if status and not index.set_status(record['path'], record.get('mtime_ns'), record['size'], status, key_id):
+        index.scan(record['path'], key_id, status)
+    if outcome in ("Encrypted", "Rekeyed"):
+        index.scan(os.path.join(output_dir, record['output']), new_key_id, 'ok')
+
+def print_summary(counts, total_bytes, elapsed):
+    images = sum(count for mode, count in counts.items() if mode != "Skipped")
+    elapsed = max(elapsed, 1e-9)
+    print(f"\n{images} images in {elapsed:.1f}s: {images / elapsed:.1f} images/s, {total_bytes / elapsed / (1 << 20):.1f} MB/s")
+    for mode, count in sorted(counts.items()):
+        print(f"  {mode}: {count}")
 
 def main():
     parser = argparse.ArgumentParser(description="Anti-Seek 图像潜影批处理工具")
     parser.add_argument('-i', '--input', required=True, help="输入目录")
     parser.add_argument('-o', '--output', default=None, help="输出目录")
     parser.add_argument('-t', '--threads', type=int, default=None, help="工作线程数")
+    parser.add_argument('-p', '--processes', type=int, default=0, help="使用多进程处理并指定进程数 (默认: 0, 使用线程)")
+    parser.add_argument('--max-inflight', type=int, default=0, help="同时处理中的图片数上限 (默认: 工作数的 4 倍)")
     parser.add_argument('-s', '--salt', default="", help="安全加盐字符串")
+    parser.add_argument('--keyring', default="", help="逗号分隔的备用盐值: 解密/--rekey 时在 -s 之外一并尝试, 带密钥校验 (as_kc) 的图片可直接选出匹配的盐值")
     parser.add_argument('-k', '--keyname', default="s_tag", help="元数据键名 (默认: s_tag)")
+    parser.add_argument('-m', '--mode', default='pixels', choices=['pixels', 'bytes'], help="加密模式: pixels 加密像素, bytes 直接加密原文件字节 (默认: pixels)")
+    parser.add_argument('--rekey', action='store_true', help="更换盐值/键名: 用 -s/-k 校验旧密文, 以新盐值/键名重新加密, 不落地明文")
+    parser.add_argument('--new-salt', default=None, help="--rekey 使用的新盐值 (默认: 与 -s 相同)")
+    parser.add_argument('--new-keyname', default=None, help="--rekey 使用的新键名 (默认: 与 -k 相同)")
+    parser.add_argument('--incremental', action='store_true', help="增量处理: 跳过清单中记录且未变化的文件, 可用于中断后继续")
+    parser.add_argument('--preview', type=int, default=0, help="加密时内嵌单独加密的预览图, 指定最长边像素 (默认: 0, 不生成)")
+    parser.add_argument('--index', default=None, help="SQLite 索引文件路径 (如 WebUI 的 cache/index.sqlite): 记录校验结果, --rekey 时据此跳过未加密与无法校验的文件")
+    parser.add_argument('--compress-level', type=int, default=0, choices=range(10), help="密文 PNG 压缩等级 (默认: 0, 直接存储)")
+    parser.add_argument('--png-filter', default='none', choices=['none', 'adaptive'], help="密文 PNG 行滤波: none 为快速写入, adaptive 使用 Pillow 自适应滤波 (默认: none)")
     
     args = parser.parse_args()
     
@@ -127,21 +342,66 @@ def main():
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
         
-    tasks = []
     valid_exts = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
     
-    with ThreadPoolExecutor(max_workers=args.threads) as executor:
-        for root, _, files in os.walk(input_dir):
-            if os.path.abspath(root) == os.path.abspath(output_dir):
+    if args.processes:
+        executor = ProcessPoolExecutor(max_workers=args.processes, initializer=set_max_workers, initargs=((os.cpu_count() or 1) // args.processes,))
+        workers = args.processes
+    else:
+        workers = args.threads or min(32, (os.cpu_count() or 1) + 4)
+        executor = ThreadPoolExecutor(max_workers=workers)
+    max_inflight = args.max_inflight or workers * 4
+    
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path) if args.incremental else {}
+    
+    new_salt = args.salt if args.new_salt is None else args.new_salt
+    new_keyname = args.new_keyname or args.keyname
+    salts = parse_keyring(args.salt, args.keyring)
+    key_id = get_key_id('\0'.join(salts), args.keyname)
+    new_key_id = get_key_id(new_salt, new_keyname) if args.rekey else key_id
+    index = FileIndex(args.index) if args.index else None
+    if args.rekey:
+        params = get_run_params({'rekey': True, 'salts': salts, 'keyname': args.keyname, 'new_salt': new_salt, 'new_keyname': new_keyname, 'compress_level': args.compress_level})
+    else:
+        params = get_run_params({'rekey': False, 'salts': salts, 'keyname': args.keyname, 'mode': args.mode, 'preview': args.preview, 'compress_level': args.compress_level, 'png_filter': args.png_filter})
+    
+    counts = Counter()
+    total_bytes = 0
+    known = []
+    
+    def iter_pending():
+        for file_path in iter_files(input_dir, output_dir, valid_exts):
+            if is_unchanged(manifest.get(os.path.relpath(file_path, input_dir)), file_path, output_dir, params):
+                counts["Skipped"] += 1
                 continue
-                
-            for file in files:
-                if file.lower().endswith(valid_exts):
-                    file_path = os.path.join(root, file)
-                    tasks.append(executor.submit(process_worker, file_path, output_dir, args.salt, args.keyname))
+            record = get_index_outcome(index, file_path, key_id, args.keyname, args.rekey) if index else None
+            if record is not None:
+                known.append(record)
+                continue
+            yield file_path
     
-    for task in tasks:
-        task.result()
+    start = time.perf_counter()
+    with executor, open(manifest_path, 'a' if args.incremental else 'w', encoding='utf-8') as manifest_file:
+        if args.rekey:
+            records = run_bounded(executor, rekey_worker, iter_pending(), max_inflight, output_dir, args.salt, args.keyname, new_salt, new_keyname, args.compress_level, salts[1:])
+        else:
+            records = run_bounded(executor, process_worker, iter_pending(), max_inflight, output_dir, args.salt, args.keyname, args.compress_level, args.png_filter, args.mode, args.preview, salts[1:])
+        # known is filled while the pool is fed, so it is complete once the
+        # pool's records are exhausted.
+        for record in chain(records, known):
+            counts[record['outcome']] += 1
+            total_bytes += record['size']
+            if index is not None:
+                try:
+                    update_index(index, record, output_dir, key_id, new_key_id)
+                except Exception as e:
+                    print(f"[Error] index update failed for {record['path']}: {e}")
+            record['path'] = os.path.relpath(record['path'], input_dir)
+            record['params'] = params
+            manifest_file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            manifest_file.flush()
+    print_summary(counts, total_bytes, time.perf_counter() - start)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file